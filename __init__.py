@@ -1,8 +1,15 @@
 from .comfyui_whisk import NODE_CLASS_MAPPINGS as WHISK_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as WHISK_NODE_DISPLAY_NAME_MAPPINGS
 from .comfyui_imagefx import NODE_CLASS_MAPPINGS as COMFYUI_IMAGEFX_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as COMFYUI_IMAGEFX_NODE_DISPLAY_NAME_MAPPINGS
+from .comfyui_archive import NODE_CLASS_MAPPINGS as ARCHIVE_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as ARCHIVE_NODE_DISPLAY_NAME_MAPPINGS
+from .comfyui_queue import NODE_CLASS_MAPPINGS as QUEUE_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as QUEUE_NODE_DISPLAY_NAME_MAPPINGS
+from .metrics import register_routes as register_metrics_routes
 
-NODE_CLASS_MAPPINGS = {**WHISK_NODE_CLASS_MAPPINGS, **COMFYUI_IMAGEFX_NODE_CLASS_MAPPINGS}
-NODE_DISPLAY_NAME_MAPPINGS = {**WHISK_NODE_DISPLAY_NAME_MAPPINGS, **COMFYUI_IMAGEFX_NODE_DISPLAY_NAME_MAPPINGS}
+NODE_CLASS_MAPPINGS = {**WHISK_NODE_CLASS_MAPPINGS, **COMFYUI_IMAGEFX_NODE_CLASS_MAPPINGS, **ARCHIVE_NODE_CLASS_MAPPINGS,
+                       **QUEUE_NODE_CLASS_MAPPINGS}
+NODE_DISPLAY_NAME_MAPPINGS = {**WHISK_NODE_DISPLAY_NAME_MAPPINGS, **COMFYUI_IMAGEFX_NODE_DISPLAY_NAME_MAPPINGS,
+                              **ARCHIVE_NODE_DISPLAY_NAME_MAPPINGS, **QUEUE_NODE_DISPLAY_NAME_MAPPINGS}
+
+register_metrics_routes()
 
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
 
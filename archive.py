@@ -0,0 +1,176 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+ARCHIVE_DIR = os.environ.get("LABS_GOOGLE_ARCHIVE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "archive")
+INDEX_FILE = "index.jsonl"
+
+# (magic prefix, extension, MIME type) used to name archived objects.
+_FORMATS = (
+    (b"\x89PNG\r\n\x1a\n", ".png", "image/png"),
+    (b"\xff\xd8\xff", ".jpg", "image/jpeg"),
+    (b"RIFF", ".webp", "image/webp"),
+)
+
+
+def sniff_format(image_bytes: bytes) -> Tuple[str, str]:
+    """Return (extension, MIME type) for encoded image bytes"""
+    for magic, extension, mime_type in _FORMATS:
+        if image_bytes.startswith(magic):
+            return extension, mime_type
+    return ".bin", "application/octet-stream"
+
+
+def _matches(entry: Dict, terms: List[str]) -> bool:
+    for term in terms:
+        field, sep, value = term.partition(":")
+        if sep and field in entry:
+            if str(entry[field]).lower() != value:
+                return False
+        else:
+            text = f"{entry.get('prompt', '')}\n{entry.get('storyboard_prompt', '')}".lower()
+            if term not in text:
+                return False
+    return True
+
+
+class ImageArchive:
+    """
+    Content-addressed store of generated images exactly as the API returned them.
+
+    Objects live under objects/<2 hex>/<sha256><ext>, so the same image is
+    only written once. index.jsonl gets one line per archived image with its
+    prompt, seed, storyboard prompt and timestamp; it is only appended to
+    and is re-read when another process changes it.
+    """
+
+    def __init__(self, archive_dir: str = ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        self._entries: Optional[List[Dict]] = None
+        self._signature = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.archive_dir, INDEX_FILE)
+
+    def path(self, entry: Dict) -> str:
+        return os.path.join(self.archive_dir, entry["file"])
+
+    def _write_object(self, image_bytes: bytes) -> Dict:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        extension, mime_type = sniff_format(image_bytes)
+        relative = os.path.join("objects", digest[:2], digest + extension)
+        path = os.path.join(self.archive_dir, relative)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+
+        return {"id": digest, "file": relative, "mime": mime_type, "bytes": len(image_bytes)}
+
+    def add(self, images: List[bytes], **fields) -> List[Dict]:
+        """
+        Archive encoded images and index them.
+
+        Args:
+            images: Encoded image bytes as returned by the API
+            **fields: JSON-serializable metadata stored with every image,
+                e.g. node, prompt, seed, storyboard_prompt
+
+        Returns:
+            List[Dict]: The new index entries, empty if writing failed
+        """
+        if not images:
+            return []
+
+        created = time.time()
+        with self._lock:
+            try:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                entries = []
+                for position, image_bytes in enumerate(images):
+                    entry = self._write_object(image_bytes)
+                    entry.update(fields, created=created, position=position)
+                    entries.append(entry)
+
+                lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+            except OSError as e:
+                print(f"Archive write error: {str(e)}")
+                return []
+
+            # Drop the in-memory index; it is reloaded on the next read.
+            self._entries = None
+            return entries
+
+    def signature(self) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, size) of the index file, or None if nothing is archived yet"""
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def entries(self) -> List[Dict]:
+        """All index entries, oldest first"""
+        with self._lock:
+            signature = self.signature()
+            if self._entries is None or signature != self._signature:
+                entries = []
+                if signature is not None:
+                    with open(self.index_path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            try:
+                                entries.append(json.loads(line))
+                            except ValueError:
+                                # A partially written last line from a crash
+                                continue
+                self._entries = entries
+                self._signature = signature
+            return self._entries
+
+    def query(self, text: str = "", newest_first: bool = True) -> List[Dict]:
+        """
+        Filter index entries.
+
+        Args:
+            text: Space separated terms, all of which must match. "field:value"
+                compares an index field (e.g. "node:whisk seed:42"), any other
+                term is a case-insensitive substring of the prompt or
+                storyboard prompt.
+            newest_first: Return the most recently archived entries first
+
+        Returns:
+            List[Dict]: Matching entries
+        """
+        terms = text.lower().split()
+        matched = [entry for entry in self.entries() if _matches(entry, terms)]
+        return matched[::-1] if newest_first else matched
+
+    def read_bytes(self, entry: Dict) -> bytes:
+        with open(self.path(entry), 'rb') as f:
+            return f.read()
+
+    def open_image(self, entry: Dict, max_edge: int = 0) -> "Image.Image":
+        """Decode an archived image straight from a memory map of its file"""
+        from .utils import open_image
+
+        with open(self.path(entry), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return open_image(mapped, max_edge)
+
+
+image_archive = ImageArchive()
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional, TypeVar
+
+from .auth import credential_pool
+from .limiter import get_limiter
+from .metrics import endpoint_name, metrics
+from .result_cache import request_key
+from .retry import HEDGE_PERCENTILE, HEDGE_REQUESTS, hedged_async, latency_tracker, retry_policy
+
+if TYPE_CHECKING:
+    import requests
+
+# Worker threads available to the event loop for blocking HTTP, encode and
+# decode work. This bounds how many requests the loop can keep in flight.
+IO_WORKERS = int(os.environ.get("LABS_GOOGLE_IO_WORKERS", 32))
+
+# ComfyUI builds that can await coroutine FUNCTIONs may point the nodes at
+# their *_async entry points directly instead of the sync wrappers.
+NATIVE_ASYNC_NODES = os.environ.get("LABS_GOOGLE_ASYNC_NODES", "0") == "1"
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the background event loop shared by all nodes, starting it on first use"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="labs-google-io"))
+                threading.Thread(target=_run_loop, args=(loop,), name="labs-google-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine on the background loop and wait for its result.
+
+    Sync node FUNCTIONs use this so that every pipeline shares one loop, and
+    work started from several ComfyUI threads interleaves on it.
+    """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("async_client.run() cannot be called from the background loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def to_thread(func, *args, **kwargs):
+    """Run a blocking call on the loop's worker threads"""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def post(url: str, **kwargs) -> "requests.Response":
+    """
+    Awaitable POST through the shared pooled session.
+
+    Requests run on the loop's worker threads, so pooling, timeouts and any
+    other http_client policies apply unchanged while the caller only awaits.
+    """
+    # Imported on first use so loading the node modules doesn't pull in requests
+    from . import http_client
+
+    return await to_thread(http_client.post, url, **kwargs)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one.
+
+    The first caller for a key starts the call as its own task; every
+    caller, the first included, awaits the same outcome, result or
+    exception, so cancelling any one caller leaves the call running for the
+    others. Entries are thread-safe futures, so callers on different event
+    loops (the background loop and ComfyUI's own) share calls too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], **labels) -> T:
+        """Run fn once for all concurrent callers of key; labels tag the shared-call counter"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if leader:
+            def finished(task: asyncio.Task) -> None:
+                with self._lock:
+                    if self._calls.get(key) is future:
+                        del self._calls[key]
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            asyncio.ensure_future(fn()).add_done_callback(finished)
+        else:
+            metrics.inc("labs_google_singleflight_shared_total", **labels)
+
+        # A cancelled caller must not cancel the call for everyone else
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+
+single_flight = SingleFlight()
+
+
+async def post_authenticated(url: str, get_headers: Callable[[str], Dict[str, str]], hedge: bool = False,
+                             dedupe: bool = False, **kwargs) -> "requests.Response":
+    """
+    POST on behalf of an account leased from the credential pool.
+
+    Transient failures are retried with backoff under retry.retry_policy, each
+    attempt leasing a fresh account. With hedge=True (and LABS_GOOGLE_HEDGE=1)
+    a second request is started if the first is slower than the endpoint's
+    observed p95 latency. In-flight requests per endpoint are capped by the
+    adaptive limiter in limiter.py. With dedupe=True, concurrent calls with the same
+    URL and canonical JSON body (ignoring the session id) share a single
+    request and receive the same response object.
+
+    Args:
+        url: Endpoint to call
+        get_headers: Builds the request headers from an access token
+        hedge: Allow hedged requests for this call
+        dedupe: Share the request with identical calls already in flight
+
+    Raises:
+        requests.exceptions.RequestException: Once retries are exhausted, or
+            immediately for non-retryable status codes; a 401/403 only once
+            no other account is usable
+        auth.CredentialsExpiredError: If every configured token has expired
+        auth.CredentialsUnavailableError: If every account was rejected with
+            401/403, or none frees up in time
+    """
+    limiter = get_limiter(url)
+
+    async def send_once(lease) -> "requests.Response":
+        started = time.monotonic()
+        response = await post(
+            url,
+            headers=get_headers(lease.credentials.access_token),
+            cookies=lease.credentials.cookies,
+            **kwargs
+        )
+        response.raise_for_status()
+        latency_tracker.record(url, time.monotonic() - started)
+        return response
+
+    async def attempt() -> "requests.Response":
+        while True:
+            try:
+                async with await credential_pool.acquire_async() as lease:
+                    if limiter is None:
+                        return await send_once(lease)
+                    async with limiter.slot():
+                        return await send_once(lease)
+            except Exception as e:
+                # A 401/403 benches only this account; move the request to
+                # another one without using up a retry, while any is left
+                if not retry_policy.is_account_error(e) or not credential_pool.has_usable():
+                    raise
+                print(f"{endpoint_name(url)}: account {lease.credentials.name} was rejected "
+                      f"({str(e)}), retrying with another account")
+
+    if hedge and HEDGE_REQUESTS:
+        async def send() -> "requests.Response":
+            return await hedged_async(attempt, latency_tracker.percentile(url, HEDGE_PERCENTILE))
+    else:
+        send = attempt
+
+    async def call() -> "requests.Response":
+        return await retry_policy.call_async(send, endpoint_name(url))
+
+    if not dedupe or "json" not in kwargs:
+        return await call()
+
+    return await single_flight.do(f"{url} {request_key(kwargs['json'])}", call, endpoint=endpoint_name(url))
@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import asyncio
+import itertools
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from .retry import retry_after
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'googel.json')
+
+# Treat a token as expired slightly early so in-flight requests don't race it.
+EXPIRY_MARGIN = 60
+
+# Per-account client-side rate limit. 0 requests per minute disables it;
+# accounts can override both values in googel.json.
+REQUESTS_PER_MINUTE = float(os.environ.get("LABS_GOOGLE_ACCOUNT_RPM", 0))
+BURST = int(os.environ.get("LABS_GOOGLE_ACCOUNT_BURST", 4))
+# "least_loaded" or "round_robin"
+STRATEGY = os.environ.get("LABS_GOOGLE_ACCOUNT_STRATEGY", "least_loaded")
+# Seconds an account is benched after a 429 without Retry-After, or after a 401/403.
+RATE_LIMIT_COOLDOWN = float(os.environ.get("LABS_GOOGLE_RATE_LIMIT_COOLDOWN", 60))
+AUTH_COOLDOWN = float(os.environ.get("LABS_GOOGLE_AUTH_COOLDOWN", 600))
+# Longest a request waits for any account to become available.
+ACQUIRE_TIMEOUT = float(os.environ.get("LABS_GOOGLE_ACQUIRE_TIMEOUT", 600))
+
+
+class CredentialsExpiredError(Exception):
+    pass
+
+
+class CredentialsUnavailableError(Exception):
+    pass
+
+
+def _parse_expires(expires) -> Optional[float]:
+    """Parse the googel.json "expires" field into a UNIX timestamp, None if unknown"""
+    if not expires:
+        return None
+    if isinstance(expires, (int, float)):
+        # Accept both seconds and milliseconds since the epoch
+        return expires / 1000.0 if expires > 1e11 else float(expires)
+    try:
+        parsed = datetime.fromisoformat(str(expires).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _decode_config(content: bytes) -> str:
+    try:
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Files saved by some editors use a local code page; only pay for
+        # chardet in that case.
+        import chardet
+        return content.decode(chardet.detect(content)['encoding'] or 'utf-8')
+
+
+class Credentials:
+    def __init__(self, access_token: str, cookies: Dict[str, str], user: Optional[Dict] = None, expires=None,
+                 name: Optional[str] = None, requests_per_minute: float = REQUESTS_PER_MINUTE, burst: int = BURST):
+        self.access_token = access_token
+        self.cookies = cookies
+        self.user = user or {}
+        self.expires = expires
+        self.expires_at = _parse_expires(expires)
+        self.name = name or self.user.get('email') or cookies.get('EMAIL') or f"account-{access_token[-6:]}"
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+
+    def is_expired(self, margin: float = EXPIRY_MARGIN) -> bool:
+        return self.expires_at is not None and time.time() + margin >= self.expires_at
+
+    @classmethod
+    def from_config(cls, auth_config: Dict) -> "Credentials":
+        access_token = auth_config.get('access_token')
+        if not access_token:
+            raise ValueError("Access token not found in googel.json")
+
+        return cls(
+            access_token=access_token,
+            cookies={cookie['name']: cookie['value'] for cookie in auth_config.get('cookies', [])},
+            user=auth_config.get('user', {}),
+            expires=auth_config.get('expires'),
+            name=auth_config.get('name'),
+            requests_per_minute=float(auth_config.get('requests_per_minute', REQUESTS_PER_MINUTE)),
+            burst=int(auth_config.get('burst', BURST)),
+        )
+
+
+def parse_accounts(auth_config: Dict) -> List[Credentials]:
+    """
+    Parse googel.json into a list of accounts.
+
+    The file either holds a single account at the top level, or a list of
+    accounts in the same format under "accounts".
+    """
+    if 'accounts' in auth_config:
+        accounts = [Credentials.from_config(account) for account in auth_config['accounts']]
+        if not accounts:
+            raise ValueError("No accounts found in googel.json")
+        return accounts
+    return [Credentials.from_config(auth_config)]
+
+
+class CredentialStore:
+    """
+    Parsed googel.json, cached in memory.
+
+    The file is only re-read when its modification time or size changes,
+    so edits (for example a refreshed token) are picked up without
+    restarting ComfyUI.
+    """
+
+    def __init__(self, path: str = CONFIG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._accounts: Optional[List[Credentials]] = None
+
+    def get_accounts(self) -> List[Credentials]:
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature and self._accounts is not None:
+            return self._accounts
+
+        with self._lock:
+            if signature != self._signature or self._accounts is None:
+                with open(self.path, 'rb') as file:
+                    auth_config = json.loads(_decode_config(file.read()))
+                self._accounts = parse_accounts(auth_config)
+                self._signature = signature
+            return self._accounts
+
+    def get(self) -> Credentials:
+        return self.get_accounts()[0]
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: float, burst: int):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+
+class Account:
+    def __init__(self, credentials: Credentials):
+        self.credentials = credentials
+        self.bucket = TokenBucket(credentials.requests_per_minute, credentials.burst)
+        self.in_flight = 0
+        self.benched_until = 0.0
+        # Why the current bench was set: "auth" (401/403, waiting won't fix
+        # it, a new token will) or "rate_limit" (429)
+        self.bench_reason: Optional[str] = None
+        self.requests = 0
+
+    def is_rejected(self, now: float) -> bool:
+        return self.bench_reason == "auth" and self.benched_until > now
+
+
+class Lease:
+    """
+    One request's claim on an account.
+
+    Used as a (async) context manager around the request; an HTTPError with
+    status 429, 401 or 403 raised inside the block benches the account.
+    """
+
+    def __init__(self, pool: "CredentialPool", account: Account):
+        self.pool = pool
+        self.account = account
+        self.credentials = account.credentials
+        self._released = False
+
+    def release(self, status_code: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        if not self._released:
+            self._released = True
+            self.pool._release(self.account, status_code, retry_after)
+
+    def _release_for(self, exc) -> None:
+        response = getattr(exc, "response", None)
+        status_code = getattr(response, "status_code", None)
+        self.release(status_code, retry_after(response))
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._release_for(exc)
+
+    async def __aenter__(self) -> "Lease":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._release_for(exc)
+
+
+class CredentialPool:
+    """
+    Routes requests across every account in googel.json.
+
+    Each account has its own token bucket. Requests go to the least loaded
+    ready account (or round robin), and accounts answering 429 or 401/403
+    are benched for a cooldown.
+    """
+
+    def __init__(self, store: CredentialStore, strategy: str = STRATEGY):
+        self.store = store
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._source: Optional[List[Credentials]] = None
+        self._accounts: List[Account] = []
+        self._cursor = itertools.count()
+
+    def _sync(self) -> List[Account]:
+        credentials_list = self.store.get_accounts()
+        if credentials_list is not self._source:
+            # Keep load and bench state for tokens that survived a reload
+            previous = {account.credentials.access_token: account for account in self._accounts}
+            accounts = []
+            for credentials in credentials_list:
+                account = previous.get(credentials.access_token)
+                if account is None:
+                    account = Account(credentials)
+                else:
+                    account.credentials = credentials
+                accounts.append(account)
+            self._accounts = accounts
+            self._source = credentials_list
+        return self._accounts
+
+    def _usable(self, now: float) -> List[Account]:
+        """
+        Accounts worth waiting for; call with the lock held.
+
+        Raises:
+            CredentialsExpiredError: If every account's token has expired
+            CredentialsUnavailableError: If every remaining account was rejected with 401/403
+        """
+        usable = [account for account in self._sync() if not account.credentials.is_expired()]
+        if not usable:
+            raise CredentialsExpiredError("Every access token in googel.json has expired, please update them")
+        usable = [account for account in usable if not account.is_rejected(now)]
+        if not usable:
+            raise CredentialsUnavailableError(
+                "Every account in googel.json was rejected with HTTP 401/403, please update the tokens")
+        return usable
+
+    def has_usable(self) -> bool:
+        """Whether any account is unexpired and not rejected with 401/403"""
+        with self._lock:
+            try:
+                self._usable(time.monotonic())
+            except (CredentialsExpiredError, CredentialsUnavailableError):
+                return False
+            return True
+
+    def _try_acquire(self) -> Tuple[Optional[Lease], float]:
+        with self._lock:
+            now = time.monotonic()
+            usable = self._usable(now)
+
+            ready = [account for account in usable
+                     if account.benched_until <= now and account.bucket.wait_time(now) == 0]
+            if not ready:
+                wait = min(max(account.benched_until - now, account.bucket.wait_time(now)) for account in usable)
+                return None, max(wait, 0.01)
+
+            if self.strategy == "round_robin":
+                account = ready[next(self._cursor) % len(ready)]
+            else:
+                account = min(ready, key=lambda candidate: (candidate.in_flight, candidate.requests))
+
+            account.bucket.take(now)
+            account.in_flight += 1
+            account.requests += 1
+            return Lease(self, account), 0.0
+
+    def _release(self, account: Account, status_code: Optional[int], retry_after: Optional[float]) -> None:
+        with self._lock:
+            account.in_flight -= 1
+            if status_code == 429:
+                cooldown = retry_after if retry_after is not None else RATE_LIMIT_COOLDOWN
+                reason = "rate_limit"
+            elif status_code in (401, 403):
+                cooldown = AUTH_COOLDOWN
+                reason = "auth"
+            else:
+                # The token was accepted, so an auth bench still running is
+                # only something to wait out
+                if account.bench_reason == "auth":
+                    account.bench_reason = "rate_limit"
+                return
+            # The latest answer says why the account is benched: a 429 means
+            # the token was accepted, a 401/403 that it no longer is
+            account.bench_reason = reason
+            account.benched_until = max(account.benched_until, time.monotonic() + cooldown)
+        print(f"Account {account.credentials.name} got HTTP {status_code}, benched for {cooldown:.0f}s")
+
+    async def acquire_async(self, timeout: float = ACQUIRE_TIMEOUT) -> Lease:
+        """
+        Wait until an account is available and lease it.
+
+        Raises:
+            CredentialsExpiredError: If every account's token has expired
+            CredentialsUnavailableError: If every account was rejected with 401/403,
+                or no account frees up within timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            lease, wait = self._try_acquire()
+            if lease is not None:
+                return lease
+            if time.monotonic() + wait > deadline:
+                raise CredentialsUnavailableError("No Google Labs account available: all are rate limited or benched")
+            await asyncio.sleep(min(wait, 1.0))
+
+    def ensure_usable(self) -> None:
+        """
+        Raises:
+            CredentialsExpiredError: If every account's token has expired
+            CredentialsUnavailableError: If every account was rejected with 401/403
+        """
+        with self._lock:
+            self._usable(time.monotonic())
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                "name": account.credentials.name,
+                "in_flight": account.in_flight,
+                "requests": account.requests,
+                "benched_for": max(0.0, account.benched_until - now),
+                "expired": account.credentials.is_expired(),
+            } for account in self._sync()]
+
+
+credential_store = CredentialStore()
+credential_pool = CredentialPool(credential_store)
@@ -0,0 +1,90 @@
+"""
+Microbenchmark for utils.pil2tensor / utils.tensor2pil.
+
+Compares the batched converters against the previous per-image
+implementation at 1024x1024 and 2048x2048 for several batch sizes.
+
+    python benchmarks/bench_convert.py [--repeat 5]
+"""
+import os
+import argparse
+import importlib.util
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_utils():
+    spec = importlib.util.spec_from_file_location("labs_google_utils", os.path.join(ROOT, "utils.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_pil2tensor(image):
+    if isinstance(image, list):
+        if len(image) == 0:
+            return torch.empty(0)
+        return torch.cat([legacy_pil2tensor(img) for img in image], dim=0)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    img_array = np.array(image).astype(np.float32) / 255.0
+    return torch.from_numpy(img_array)[None,]
+
+
+def legacy_tensor2pil(image):
+    batch_count = image.size(0) if len(image.shape) > 3 else 1
+    if batch_count > 1:
+        out = []
+        for i in range(batch_count):
+            out.extend(legacy_tensor2pil(image[i]))
+        return out
+    numpy_image = np.clip(255.0 * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8)
+    return [Image.fromarray(numpy_image)]
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048])
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    utils = load_utils()
+    rng = np.random.default_rng(0)
+
+    print(f"{'case':<28}{'legacy ms':>12}{'batched ms':>12}{'speedup':>10}")
+    for size in args.sizes:
+        for batch in args.batches:
+            pil_images = [Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)) for _ in range(batch)]
+            tensor = utils.pil2tensor(pil_images)
+
+            assert torch.equal(tensor, legacy_pil2tensor(pil_images))
+            assert all(np.array_equal(np.array(a), np.array(b))
+                       for a, b in zip(utils.tensor2pil(tensor), legacy_tensor2pil(tensor)))
+
+            for name, legacy, batched in (
+                ("pil2tensor", lambda: legacy_pil2tensor(pil_images), lambda: utils.pil2tensor(pil_images)),
+                ("tensor2pil", lambda: legacy_tensor2pil(tensor), lambda: utils.tensor2pil(tensor)),
+            ):
+                legacy_s = best_of(legacy, args.repeat)
+                batched_s = best_of(batched, args.repeat)
+                case = f"{name} {batch}x{size}^2"
+                print(f"{case:<28}{legacy_s * 1000:>12.1f}{batched_s * 1000:>12.1f}{legacy_s / batched_s:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Measure how long loading the node pack takes at ComfyUI startup.
+
+Each run imports the package in a fresh interpreter with -X importtime,
+the way ComfyUI's custom node loader does, and reports the wall time, the
+third-party modules it pulled in and the slowest top-level imports.
+comfy.utils is stubbed because ComfyUI has already imported it by then.
+Pass --ref to measure another git revision too for a before/after view.
+
+    python benchmarks/bench_import.py --repeat 5
+    python benchmarks/bench_import.py --ref HEAD~1
+"""
+import os
+import sys
+import json
+import tarfile
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "numpy", "PIL", "requests", "chardet", "simplejpeg")
+
+CHILD = r"""
+import os, sys, json, time, types, importlib.util
+comfy = types.ModuleType("comfy")
+comfy.utils = types.ModuleType("comfy.utils")
+sys.modules["comfy"], sys.modules["comfy.utils"] = comfy, comfy.utils
+root = sys.argv[1]
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("labs_google", os.path.join(root, "__init__.py"),
+                                              submodule_search_locations=[root])
+package = importlib.util.module_from_spec(spec)
+sys.modules["labs_google"] = package
+spec.loader.exec_module(package)
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds": seconds, "nodes": len(package.NODE_CLASS_MAPPINGS),
+                  "heavy": [name for name in HEAVY if name in sys.modules]}))
+"""
+
+
+def parse_importtime(stderr: str):
+    """Return [(cumulative_us, module)] for top-level imports in -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        # Nested imports are indented by two spaces per level
+        if name.startswith(" ") and not name.startswith("   "):
+            imports.append((int(cumulative), name.strip()))
+    return imports
+
+
+def measure(root: str):
+    code = f"HEAVY = {HEAVY_MODULES!r}\n" + CHILD
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code, root],
+                               capture_output=True, text=True, cwd=tempfile.gettempdir())
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(completed.stderr)
+    return result
+
+
+def report(label: str, root: str, repeat: int, top: int) -> None:
+    try:
+        runs = [measure(root) for _ in range(repeat)]
+    except RuntimeError as e:
+        print(f"{label}: import failed: {e}")
+        return
+
+    seconds = [run["seconds"] for run in runs]
+    last = runs[-1]
+    print(f"{label}: median {statistics.median(seconds) * 1000:.1f} ms "
+          f"(min {min(seconds) * 1000:.1f} ms, {repeat} runs), {last['nodes']} nodes")
+    print(f"  heavy modules loaded: {', '.join(last['heavy']) or 'none'}")
+    for cumulative, name in sorted(last["imports"], reverse=True)[:top]:
+        print(f"  {cumulative / 1000:>9.1f} ms  {name}")
+
+
+def export_revision(rev: str, target: str) -> str:
+    archive_path = os.path.join(target, "tree.tar")
+    with open(archive_path, "wb") as f:
+        subprocess.run(["git", "archive", rev], cwd=ROOT, stdout=f, check=True)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(os.path.join(target, "tree"))
+    return os.path.join(target, "tree")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", help="also measure this git revision, e.g. HEAD~1")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    args = parser.parse_args()
+
+    if args.ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            report(args.ref, export_revision(args.ref, tmp), args.repeat, args.top)
+    report("working tree", ROOT, args.repeat, args.top)
+
+
+if __name__ == "__main__":
+    main()
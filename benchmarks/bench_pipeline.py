@@ -0,0 +1,213 @@
+"""
+End-to-end benchmark of the ImageFx and Whisk nodes against a local mock.
+
+Starts benchmarks/mock_server.py in-process, routes the package's shared
+HTTP session to it, stubs comfy.utils so no ComfyUI install is needed, and
+drives the real node classes. Reports throughput, p50/p99 latency, peak RSS
+and the per-stage timings recorded by metrics.py.
+
+    python benchmarks/bench_pipeline.py --node imagefx --requests 40 --concurrency 8
+    python benchmarks/bench_pipeline.py --node whisk --requests 10 --failure-rate 0.1
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import tempfile
+import importlib
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+try:
+    import resource
+except ImportError:
+    # Windows; peak memory then comes from psutil if it is installed
+    resource = None
+
+from mock_server import add_arguments, config_from_args, start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "labs_google"
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Rewrites requests for a real API host onto the mock server"""
+
+    def __init__(self, prefix: str, target: str, **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+        self.target = target
+
+    def send(self, request, **kwargs):
+        if request.url.startswith(self.prefix):
+            request.url = self.target + request.url[len(self.prefix):]
+        return super().send(request, **kwargs)
+
+
+def stub_comfy() -> None:
+    class ProgressBar:
+        def __init__(self, total):
+            self.total = total
+
+        def update_absolute(self, value, total=None, preview=None):
+            pass
+
+        def update(self, value):
+            pass
+
+    comfy = types.ModuleType("comfy")
+    comfy_utils = types.ModuleType("comfy.utils")
+    comfy_utils.ProgressBar = ProgressBar
+    comfy.utils = comfy_utils
+    sys.modules.setdefault("comfy", comfy)
+    sys.modules.setdefault("comfy.utils", comfy_utils)
+
+
+def load_package():
+    """Import the repository as a package without ComfyUI's custom node loader"""
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def submodule(name: str):
+    # Most submodules are imported lazily by the package, so import on demand
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
+
+
+def setup_package(base_url: str, pool_size: int):
+    stub_comfy()
+    load_package()
+    http_client = submodule("http_client")
+    auth = submodule("auth")
+
+    config_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump({"access_token": "mock-token", "expires": "", "cookies": [{"name": "EMAIL", "value": "bench@example.com"}]},
+              config_file)
+    config_file.close()
+    auth.credential_store.path = config_file.name
+
+    http_client.configure(pool_maxsize=pool_size, host_limits={
+        http_client.LABS_HOST: pool_size,
+        http_client.AISANDBOX_HOST: pool_size,
+    })
+    session = http_client.get_session()
+    for prefix in (http_client.LABS_HOST, http_client.AISANDBOX_HOST):
+        session.mount(prefix, RedirectAdapter(prefix, f"{base_url}/", pool_maxsize=pool_size,
+                                              pool_block=http_client.POOL_BLOCK))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None if it can't be measured"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / (1024.0 * 1024.0)
+
+
+def percentile(samples, q):
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def run_imagefx(args):
+    node = submodule("comfyui_imagefx").ComfyUIImageFxNode()
+
+    def job(i):
+        node.generate_image(prompt=f"benchmark prompt {i}", seed=i, aspect_ratio="1:1 (Square)",
+                            num_images=args.num_images)
+
+    return job
+
+
+def run_whisk(args):
+    import torch
+
+    node = submodule("comfyui_whisk").WhiskNode()
+    generator = torch.Generator().manual_seed(0)
+
+    def reference():
+        return torch.rand((1, args.reference_size, args.reference_size, 3), generator=generator)
+
+    shared = [reference() for _ in range(3)]
+
+    def job(i):
+        subject, scene, style = shared if args.reuse_references else (reference(), reference(), reference())
+        node.generate_image(prompt=f"benchmark prompt {i}", subject_image=subject, scene_image=scene,
+                            style_image=style, num_images=args.num_images, seed=i)
+
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--node", choices=["imagefx", "whisk"], default="imagefx")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--num-images", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=16)
+    parser.add_argument("--reference-size", type=int, default=2048, help="edge of the Whisk reference images")
+    parser.add_argument("--reuse-references", action="store_true", help="send the same Whisk references every run")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock_config = config_from_args(args)
+    server, base_url = start_server(mock_config)
+    setup_package(base_url, args.pool_size)
+    metrics = submodule("metrics").metrics
+
+    job = run_imagefx(args) if args.node == "imagefx" else run_whisk(args)
+    latencies = []
+    errors = []
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            job(i)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(timed, range(args.requests)))
+    wall = time.perf_counter() - started
+    server.shutdown()
+
+    peak_rss = peak_rss_mb()
+    print(f"node={args.node} requests={args.requests} concurrency={args.concurrency} "
+          f"images/request={args.num_images} image_size={args.image_size}")
+    print(f"ok={len(latencies)} errors={len(errors)} wall={wall:.2f}s "
+          f"throughput={len(latencies) / wall:.2f} req/s ({len(latencies) * args.num_images / wall:.2f} images/s)")
+    print(f"latency p50={percentile(latencies, 0.50):.3f}s p99={percentile(latencies, 0.99):.3f}s "
+          f"max={max(latencies, default=float('nan')):.3f}s")
+    print(f"peak_rss={'n/a' if peak_rss is None else f'{peak_rss:.1f} MB'} mock_requests={mock_config.requests} "
+          f"injected_failures={mock_config.failures} uploaded={mock_config.bytes_in / 1e6:.1f} MB")
+    if errors:
+        print(f"first error: {errors[0]}")
+
+    print("\nstage                                      count    mean ms")
+    stages = metrics.snapshot()["histograms"].get("labs_google_stage_seconds", {})
+    for labels, values in sorted(stages.items()):
+        if values["count"]:
+            print(f"{labels:<42} {values['count']:>6} {values['sum'] / values['count'] * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Local stand-in for the labs.google / aisandbox endpoints used by the nodes.
+
+Serves v1:runImageFx, backbone.generateCaption and
+backbone.generateStoryBoardPrompt with realistic base64 image payloads,
+configurable latency and injected failures.
+
+    python benchmarks/mock_server.py --port 8765 --image-size 1024 --imagefx-latency 2.0
+"""
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+
+class MockConfig:
+    def __init__(self, image_size=1024, image_format="PNG", imagefx_latency=2.0, caption_latency=0.5,
+                 storyboard_latency=0.5, jitter=0.2, failure_rate=0.0, failure_status=503, seed=0):
+        self.image_size = image_size
+        self.image_format = image_format
+        self.latency = {
+            "v1:runImageFx": imagefx_latency,
+            "backbone.generateCaption": caption_latency,
+            "backbone.generateStoryBoardPrompt": storyboard_latency,
+        }
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.images = self._make_images(seed)
+
+    def _make_images(self, seed, count=4):
+        # Noise compresses about as badly as real photos, which keeps the
+        # payload size realistic for the chosen resolution.
+        rng = np.random.default_rng(seed)
+        images = []
+        for _ in range(count):
+            pixels = rng.integers(0, 256, (self.image_size, self.image_size, 3), dtype=np.uint8)
+            buffered = BytesIO()
+            Image.fromarray(pixels).save(buffered, format=self.image_format)
+            images.append(base64.b64encode(buffered.getvalue()).decode("ascii"))
+        return images
+
+    def sleep_for(self, endpoint):
+        with self.lock:
+            delay = self.rng.gauss(self.latency.get(endpoint, 0.0), self.jitter * self.latency.get(endpoint, 0.0))
+        time.sleep(max(0.0, delay))
+
+    def should_fail(self):
+        with self.lock:
+            return self.rng.random() < self.failure_rate
+
+
+def make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+            with config.lock:
+                config.requests += 1
+                config.bytes_in += len(body)
+
+            config.sleep_for(endpoint)
+
+            if config.should_fail():
+                with config.lock:
+                    config.failures += 1
+                self._send_json(config.failure_status, {"error": "injected failure"}, {"Retry-After": "0"})
+                return
+
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": "invalid json"})
+                return
+
+            if endpoint == "v1:runImageFx":
+                user_input = payload.get("userInput", {})
+                count = int(user_input.get("candidatesCount", 1))
+                seed = int(user_input.get("seed", 0))
+                generated = [{
+                    "encodedImage": config.images[i % len(config.images)],
+                    "seed": seed + i,
+                    "mediaGenerationId": f"mock-{seed}-{i}",
+                    "prompt": (user_input.get("prompts") or [""])[0],
+                } for i in range(count)]
+                self._send_json(200, {"imagePanels": [{"prompt": generated[0]["prompt"] if generated else "",
+                                                       "generatedImages": generated}]})
+            elif endpoint == "backbone.generateCaption":
+                category = payload.get("json", {}).get("category", "")
+                self._send_json(200, {"result": {"data": {"json": f"mock caption for {category.lower()}"}}})
+            elif endpoint == "backbone.generateStoryBoardPrompt":
+                additional = payload.get("json", {}).get("additionalInput", "")
+                self._send_json(200, {"result": {"data": {"json": f"mock storyboard: {additional}"}}})
+            else:
+                self._send_json(404, {"error": f"unknown endpoint {endpoint}"})
+
+    return Handler
+
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the mock in a daemon thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="labs-google-mock", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--image-format", default="PNG", choices=["PNG", "JPEG"])
+    parser.add_argument("--imagefx-latency", type=float, default=2.0, help="mean seconds per runImageFx call")
+    parser.add_argument("--caption-latency", type=float, default=0.5)
+    parser.add_argument("--storyboard-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency stddev as a fraction of the mean")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503)
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        image_size=args.image_size,
+        image_format=args.image_format,
+        imagefx_latency=args.imagefx_latency,
+        caption_latency=args.caption_latency,
+        storyboard_latency=args.storyboard_latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(config_from_args(args), args.host, args.port)
+    print(f"Mock labs.google endpoints listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
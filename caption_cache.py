@@ -0,0 +1,242 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+MEMORY_ENTRIES = int(os.environ.get("LABS_GOOGLE_CAPTION_CACHE_ENTRIES", 64))
+# Setting a directory enables the on-disk tier, which survives restarts.
+CACHE_DIR = os.environ.get("LABS_GOOGLE_CAPTION_CACHE_DIR") or None
+# References whose perceptual hashes differ in at most this many of 64 bits
+# share a caption, so resized or re-encoded copies aren't captioned again.
+# A negative value disables near-duplicate matching.
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("LABS_GOOGLE_CAPTION_NEAR_DISTANCE", 4))
+# Near matches must also agree on the average color of each image quarter
+# (0-255 per channel) and on the aspect ratio.
+COLOR_TOLERANCE = 10
+ASPECT_TOLERANCE = 0.02
+# Flat or sparse images (solid swatches, line art on white) give hashes with
+# almost every bit equal, so all of them look alike; they are only matched
+# exactly. Detail is the mean brightness step between hash cells.
+MIN_HASH_BITS = 8
+MIN_DETAIL = 0.02
+
+
+def image_fingerprint(image_tensor: "torch.Tensor") -> str:
+    """
+    Hash the pixels of an image tensor.
+
+    The tensor is quantized to uint8 first so the hash reflects the pixels
+    that are actually uploaded rather than float rounding noise.
+
+    Args:
+        image_tensor: Tensor with shape [B, H, W, 3] or [H, W, 3], values in range [0, 1]
+
+    Returns:
+        str: Hex digest identifying the image content
+    """
+    import torch
+
+    pixels = (image_tensor.detach().clamp(0, 1) * 255.0).round().to(torch.uint8).cpu().contiguous()
+    digest = hashlib.sha256()
+    digest.update(str(tuple(pixels.shape)).encode("utf-8"))
+    digest.update(pixels.numpy().tobytes())
+    return digest.hexdigest()
+
+
+def image_signatures(image_tensor: "torch.Tensor") -> List[Dict]:
+    """
+    Perceptual signatures of every image in a batch, for near-duplicate lookup.
+
+    The batch is reduced to 9x8 grayscale by area averaging in one pass and
+    each bit of the 64-bit difference hash (dHash) records whether a cell is
+    brighter than its left neighbour, so resizing and recompression flip few
+    bits. Since the hash ignores color, a 2x2 grid of average colors and the
+    aspect ratio are kept alongside it.
+
+    Args:
+        image_tensor: Tensor with shape [B, H, W, 3] or [H, W, 3], values in range [0, 1]
+
+    Returns:
+        List[Dict]: {"phash", "colors", "aspect", "detail"} per image
+    """
+    import torch
+
+    if len(image_tensor.shape) <= 3:
+        image_tensor = image_tensor.unsqueeze(0)
+
+    pixels = image_tensor.detach()[..., :3].float().movedim(-1, 1)
+    gray = (pixels * pixels.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)).sum(1, keepdim=True)
+    small = torch.nn.functional.interpolate(gray, size=(8, 9), mode="area")
+    steps = small[..., 1:] - small[..., :-1]
+    bits = (steps > 0).reshape(-1, 8, 8).to(torch.uint8)
+    weights = torch.tensor([128, 64, 32, 16, 8, 4, 2, 1], dtype=torch.uint8, device=bits.device)
+    rows = (bits * weights).sum(-1).cpu().tolist()
+    details = steps.abs().mean(dim=(1, 2, 3)).cpu().tolist()
+    colors = (torch.nn.functional.interpolate(pixels, size=(2, 2), mode="area").clamp(0, 1) * 255.0)
+    colors = colors.round().to(torch.int64).reshape(len(rows), -1).cpu().tolist()
+    aspect = image_tensor.shape[2] / max(1, image_tensor.shape[1])
+
+    return [{"phash": int.from_bytes(bytes(row), "big"), "colors": grid, "aspect": aspect, "detail": detail}
+            for row, grid, detail in zip(rows, colors, details)]
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def is_distinctive(signature: Dict) -> bool:
+    """Whether the image has enough structure for its hash to identify it"""
+    bits = hamming_distance(signature["phash"], 0)
+    return MIN_HASH_BITS <= bits <= 64 - MIN_HASH_BITS and signature["detail"] >= MIN_DETAIL
+
+
+def signature_distance(a: Dict, b: Dict) -> Optional[int]:
+    """Hash distance between two signatures, or None if color or shape rule out a match"""
+    if abs(a["aspect"] - b["aspect"]) > ASPECT_TOLERANCE * max(a["aspect"], b["aspect"]):
+        return None
+    if len(a["colors"]) != len(b["colors"]) or any(
+            abs(x - y) > COLOR_TOLERANCE for x, y in zip(a["colors"], b["colors"])):
+        return None
+    return hamming_distance(a["phash"], b["phash"])
+
+
+def caption_key(image_tensor: "torch.Tensor", category: str, variant: str = "") -> str:
+    """Cache key for a caption; variant distinguishes upload encoding settings"""
+    return "-".join(part for part in (category, variant, image_fingerprint(image_tensor)) if part)
+
+
+def storyboard_key(captions: Dict, additional_input: str) -> str:
+    """
+    Cache key for a storyboard prompt, which depends only on the reference
+    captions and the user's text, not on the uploaded image bytes.
+
+    Args:
+        captions: Caption text per payload slot, e.g. {"characters": [...], "location": "..."}
+        additional_input: The prompt typed into the node
+    """
+    canonical = json.dumps({"captions": captions, "additionalInput": additional_input},
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return "storyboard-" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CaptionCache:
+    """
+    Two-tier cache of Whisk captions: an in-memory LRU and optional JSON files on disk.
+
+    Entries stored with a "signature" (see image_signatures) and a "scope"
+    such as category and upload settings are also indexed for near-duplicate
+    lookup by Hamming distance.
+    """
+
+    def __init__(self, max_entries: int = MEMORY_ENTRIES, cache_dir: Optional[str] = CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._signatures: Dict[str, Tuple[str, Dict]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, entry: Dict) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        signature = entry.get("signature")
+        if signature is not None and is_distinctive(signature):
+            self._signatures[key] = (entry.get("scope", ""), signature)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._signatures.pop(evicted, None)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def find_similar(self, signature: Dict, scope: str = "",
+                     max_distance: int = NEAR_DUPLICATE_DISTANCE) -> Optional[Dict]:
+        """
+        Closest in-memory entry of the same scope whose image matches the
+        signature's colors and aspect ratio and whose hash is within
+        max_distance bits, or None. Low-detail images never match.
+        """
+        if max_distance < 0 or not is_distinctive(signature):
+            return None
+        with self._lock:
+            best_key, best_distance = None, max_distance + 1
+            for key, (entry_scope, entry_signature) in self._signatures.items():
+                if entry_scope != scope:
+                    continue
+                distance = signature_distance(signature, entry_signature)
+                if distance is not None and distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.near_hits += 1
+            return self._entries[best_key]
+
+    def put(self, key: str, entry: Dict) -> None:
+        with self._lock:
+            self._remember(key, entry)
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Caption cache write error: {str(e)}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._signatures.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+            }
+
+
+caption_cache = CaptionCache()
+# Storyboard prompts are small strings too; they share the cache settings
+storyboard_cache = CaptionCache()
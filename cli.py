@@ -0,0 +1,198 @@
+"""
+Headless batch runner for the ImageFx and Whisk pipelines.
+
+Reads one job per line from a JSONL file, runs the jobs concurrently with
+the same request, retry and decode code as the nodes, and writes the
+images plus a results.jsonl to the output directory. Jobs whose id already
+has an "ok" line in results.jsonl are skipped, so an interrupted run can
+simply be started again.
+
+    python cli.py jobs.jsonl --output out --concurrency 8
+
+Job lines:
+
+    {"id": "cat-1", "prompt": "a cat", "seed": 1, "aspect_ratio": "1:1 (Square)", "num_images": 4}
+    {"node": "whisk", "prompt": "on the moon", "subject_image": "refs/cat.png", "num_images": 8}
+
+"node" defaults to "imagefx". A job without an "id" is identified by a hash
+of its fields.
+
+With --queue the jobs are added to the durable SQLite job queue instead
+and drained from there; images go to the image archive and each job's
+state and result stay in the queue database across restarts.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import importlib.util
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_NAME = "labs_google"
+RESULTS_FILE = "results.jsonl"
+
+
+def load_package():
+    """Import this directory as a package, without ComfyUI, when run as a script"""
+    if __package__:
+        return importlib.import_module(__package__)
+    if PACKAGE_NAME not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE_NAME, os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE_NAME] = package
+        spec.loader.exec_module(package)
+    return sys.modules[PACKAGE_NAME]
+
+
+def submodule(name: str):
+    return importlib.import_module(f"{load_package().__name__}.{name}")
+
+
+def read_jobs(path: str):
+    result_cache = submodule("result_cache")
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({str(e)})")
+            if isinstance(job, str):
+                job = {"prompt": job}
+            job.setdefault("node", "imagefx")
+            job.setdefault("id", result_cache.request_key(job)[:16])
+            jobs.append(job)
+    return jobs
+
+
+def completed_ids(output_dir: str):
+    """Ids of jobs that already succeeded in an earlier run"""
+    done = set()
+    try:
+        with open(os.path.join(output_dir, RESULTS_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get("status") == "ok":
+                    done.add(result["id"])
+    except OSError:
+        pass
+    return done
+
+
+class BatchRunner:
+    def __init__(self, output_dir: str, concurrency: int = 4, archive: bool = False):
+        self.output_dir = output_dir
+        self.concurrency = max(1, concurrency)
+        self.archive = archive
+        self.runner = submodule("job_runner").JobRunner()
+        self.ok = 0
+        self.failed = 0
+
+    def _write_images(self, job_id: str, images):
+        sniff_format = submodule("archive").sniff_format
+        files = []
+        for i, image_bytes in enumerate(images):
+            name = f"{job_id}_{i}{sniff_format(image_bytes)[0]}"
+            with open(os.path.join(self.output_dir, name), 'wb') as f:
+                f.write(image_bytes)
+            files.append(name)
+        return files
+
+    async def run_job(self, job, semaphore: asyncio.Semaphore, results_file):
+        async_client = submodule("async_client")
+        result = {"id": job["id"], "node": job["node"], "prompt": job.get("prompt", "")}
+        started = time.perf_counter()
+        async with semaphore:
+            try:
+                images, details = await self.runner.execute(job)
+                result.update(details)
+                result["files"] = await async_client.to_thread(self._write_images, job["id"], images)
+                if self.archive:
+                    archive = submodule("archive")
+                    await async_client.to_thread(archive.image_archive.add, images, node=job["node"],
+                                                 prompt=result["prompt"], seed=details["seed"],
+                                                 aspect_ratio=details["aspect_ratio"],
+                                                 storyboard_prompt=details.get("storyboard_prompt"))
+                result["status"] = "ok"
+                self.ok += 1
+            except Exception as e:
+                result["status"] = "error"
+                result["error"] = str(e)
+                self.failed += 1
+
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        results_file.flush()
+        print(f"[{self.ok + self.failed}] {job['id']}: {result['status']}"
+              + (f" ({result['error']})" if "error" in result else f" {len(result['files'])} images"))
+
+    async def run(self, jobs):
+        os.makedirs(self.output_dir, exist_ok=True)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with open(os.path.join(self.output_dir, RESULTS_FILE), 'a', encoding='utf-8') as results_file:
+            await asyncio.gather(*[self.run_job(job, semaphore, results_file) for job in jobs])
+
+
+def run_queue(jobs, concurrency: int, jobs_per_minute: float) -> int:
+    job_queue = submodule("job_queue")
+    for job in jobs:
+        job_queue.job_queue.submit(job)
+    print(f"queued {len(jobs)} jobs: {job_queue.job_queue.counts()}")
+
+    worker = job_queue.QueueWorker(job_queue.job_queue, concurrency, jobs_per_minute)
+    submodule("async_client").run(worker.run(stop_when_empty=True))
+    counts = job_queue.job_queue.counts()
+    print(f"queue: {counts}")
+    return 1 if counts["failed"] or worker.stopped else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("jobs", help="JSONL file with one job per line")
+    parser.add_argument("--output", default="output", help="directory for images and results.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--config", help="credentials file, defaults to the package's googel.json")
+    parser.add_argument("--archive", action="store_true", help="also add the images to the image archive")
+    parser.add_argument("--queue", action="store_true", help="submit the jobs to the durable job queue and drain it")
+    parser.add_argument("--rate", type=float, default=0, help="with --queue, jobs started per minute (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    load_package()
+    if args.config:
+        submodule("auth").credential_store.path = os.path.abspath(args.config)
+
+    jobs = read_jobs(args.jobs)
+    if args.queue:
+        return run_queue(jobs, args.concurrency, args.rate)
+    done = completed_ids(args.output)
+    pending = [job for job in jobs if job["id"] not in done]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, running {len(pending)}")
+    if not pending:
+        return 0
+
+    auth = submodule("auth")
+    try:
+        auth.credential_pool.ensure_usable()
+    except (OSError, ValueError, auth.CredentialsExpiredError, auth.CredentialsUnavailableError) as e:
+        print(f"Credentials unusable: {str(e)}")
+        return 2
+
+    runner = BatchRunner(args.output, args.concurrency, args.archive)
+    started = time.perf_counter()
+    submodule("async_client").run(runner.run(pending))
+    print(f"ok={runner.ok} failed={runner.failed} in {time.perf_counter() - started:.1f}s")
+    return 1 if runner.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import json
+from typing import TYPE_CHECKING, Tuple
+from .metrics import span
+from .archive import image_archive
+
+if TYPE_CHECKING:
+    import torch
+
+
+class ArchiveLoaderNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "query": ("STRING", {"default": ""}),
+                "start": ("INT", {"default": 0, "min": 0, "max": 1000000}),
+                "count": ("INT", {"default": 4, "min": 1, "max": 64}),
+            },
+            "optional": {
+                "newest_first": ("BOOLEAN", {"default": True}),
+                "max_output_edge": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("images", "metadata")
+    FUNCTION = "load_images"
+    CATEGORY = "comfyui-labs-google"
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # Re-run when new images are archived, not only when the inputs change
+        return str(image_archive.signature())
+
+    def load_images(self, query: str, start: int, count: int, newest_first: bool = True,
+                    max_output_edge: int = 0) -> Tuple["torch.Tensor", str]:
+        from PIL import ImageOps
+        from .utils import pil2tensor
+
+        # Only the index is held in memory; image files are decoded for the
+        # selected page alone.
+        entries = image_archive.query(query, newest_first)[start:start + count]
+        if not entries:
+            raise ValueError(f"No archived images match '{query}' from position {start}")
+
+        with span("archive_load", node="archive") as info:
+            images = [image_archive.open_image(entry, max_output_edge) for entry in entries]
+            info["images"] = len(images)
+
+        # One IMAGE batch needs a single size; crop the rest to the first image
+        size = images[0].size
+        images = [image if image.size == size else ImageOps.fit(image, size) for image in images]
+
+        with span("to_tensor", node="archive"):
+            return (pil2tensor(images), json.dumps(entries, ensure_ascii=False))
+
+
+NODE_CLASS_MAPPINGS = {
+    "ComfyUI-Labs-Google-Archive-Loader": ArchiveLoaderNode
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "ComfyUI-Labs-Google-Archive-Loader": "ComfyUI-Labs-Google-Archive-Loader🗂️"
+}
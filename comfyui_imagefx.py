@@ -1,89 +1,63 @@
-import os
 import json
-import base64
-import requests
-from io import BytesIO
-import numpy as np
-import torch
 import time
-from PIL import Image, UnidentifiedImageError
-from typing import List, Union, Tuple
-import comfy.utils
-from .utils import pil2tensor, tensor2pil
-import chardet
+from typing import TYPE_CHECKING, List, Optional, Union, Tuple
+from . import async_client
+from .metrics import span
+from .auth import credential_pool
+from .result_cache import result_cache, request_key
+from .archive import image_archive
+import asyncio
 
-class ComfyUIImageFxNode:
-    def __init__(self):
-        self._initialize_auth()
-        self.aspect_ratio_display = {
-            "1:1 (Square)": "IMAGE_ASPECT_RATIO_SQUARE",
-            "9:16 (Portrait)": "IMAGE_ASPECT_RATIO_PORTRAIT",
-            "16:9 (Landscape)": "IMAGE_ASPECT_RATIO_LANDSCAPE",
-            "3:4 (Portrait)": "IMAGE_ASPECT_RATIO_PORTRAIT_THREE_FOUR",
-            "4:3 (Landscape)": "IMAGE_ASPECT_RATIO_LANDSCAPE_FOUR_THREE"
-        }
-
-    def _initialize_auth(self):
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            config_file_path = os.path.join(current_dir, 'googel.json')
+# torch, PIL, requests and comfy.utils are imported on first execution so
+# registering the nodes at ComfyUI startup stays cheap.
+if TYPE_CHECKING:
+    import torch
+    from PIL import Image
 
-            with open(config_file_path, 'rb') as file:
-                content = file.read()
-                encoding = chardet.detect(content)['encoding']
-
-            with open(config_file_path, 'r', encoding=encoding) as f:
-                self.auth_config = json.load(f)
-                
-            self.access_token = self.auth_config.get('access_token')
-            self.user = self.auth_config.get('user', {})
-            self.expires = self.auth_config.get('expires')
-            self.cookies = {cookie['name']: cookie['value'] for cookie in self.auth_config.get('cookies', [])}
-
-            if not self.access_token:
-                raise ValueError("Access token not found in googel.json")
+# Display name -> runImageFx aspectRatio, shared with the Whisk node
+ASPECT_RATIOS = {
+    "1:1 (Square)": "IMAGE_ASPECT_RATIO_SQUARE",
+    "9:16 (Portrait)": "IMAGE_ASPECT_RATIO_PORTRAIT",
+    "16:9 (Landscape)": "IMAGE_ASPECT_RATIO_LANDSCAPE",
+    "3:4 (Portrait)": "IMAGE_ASPECT_RATIO_PORTRAIT_THREE_FOUR",
+    "4:3 (Landscape)": "IMAGE_ASPECT_RATIO_LANDSCAPE_FOUR_THREE"
+}
 
-        except Exception as e:
-            print(f"Authentication initialization error: {str(e)}")
-            raise
+class ComfyUIImageFxNode:
+    def __init__(self):
+        self.aspect_ratio_display = ASPECT_RATIOS
 
     @classmethod
     def INPUT_TYPES(cls):
-        aspect_ratios = [
-            "1:1 (Square)", 
-            "9:16 (Portrait)",
-            "16:9 (Landscape)", 
-            "3:4 (Portrait)",
-            "4:3 (Landscape)"
-        ]
         return {
             "required": {
                 "prompt": ("STRING", {"multiline": True}),
                 "seed": ("INT", {"default": 0, "min": 0, "max": 999999}),
-                "aspect_ratio": (aspect_ratios, {"default": "16:9 (Landscape)"}),
+                "aspect_ratio": (list(ASPECT_RATIOS), {"default": "16:9 (Landscape)"}),
                 "num_images": ("INT", {"default": 4, "min": 1, "max": 4})
+            },
+            "optional": {
+                "use_cache": ("BOOLEAN", {"default": False}),
+                "max_output_edge": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
+                "archive": ("BOOLEAN", {"default": False})
             }
         }
 
     RETURN_TYPES = ("IMAGE", "STRING")
     RETURN_NAMES = ("generated_images", "seed")
-    FUNCTION = "generate_image"
+    FUNCTION = "generate_image_async" if async_client.NATIVE_ASYNC_NODES else "generate_image"
     CATEGORY = "comfyui-labs-google"
 
     def _get_api_aspect_ratio(self, display_ratio: str) -> str:
         """Convert display aspect ratio to API format"""
         return self.aspect_ratio_display.get(display_ratio, "IMAGE_ASPECT_RATIO_LANDSCAPE")
 
-    def generate_image(self, prompt: str, seed: int, aspect_ratio: str, num_images: int = 4) -> Tuple[torch.Tensor, str]:
-        pbar = comfy.utils.ProgressBar(100)
-        session_id = f";{int(time.time() * 1000)}"
-        api_aspect_ratio = self._get_api_aspect_ratio(aspect_ratio)
-
-        headers = {
+    def _get_headers(self, access_token):
+        return {
             "accept": "*/*",
             "accept-encoding": "gzip, deflate, br, zstd",
             "accept-language": "zh-CN,zh;q=0.9,en;q=0.8",
-            "authorization": f"Bearer {self.access_token}",
+            "authorization": f"Bearer {access_token}",
             "content-type": "application/json",
             "origin": "https://labs.google",
             "referer": "https://labs.google/",
@@ -96,7 +70,12 @@ class ComfyUIImageFxNode:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
         }
 
-        json_data = {
+    def _get_cleaned_headers(self, access_token):
+        return {k: v for k, v in self._get_headers(access_token).items() if not k.startswith(':')}
+
+    def _build_request(self, prompt: str, seed: int, api_aspect_ratio: str, num_images: int, session_id: str) -> dict:
+        """Build the runImageFx request body"""
+        return {
             "userInput": {
                 "candidatesCount": num_images,
                 "prompts": [prompt],
@@ -113,73 +92,276 @@ class ComfyUIImageFxNode:
             }
         }
 
-        pbar.update_absolute(20)
+    async def _request_images(self, json_data: dict, seed: int) -> Tuple[List[str], int]:
+        """
+        Call runImageFx and return the base64 encoded images with the seed the API used.
 
-        try:
-            cleaned_headers = {k: v for k, v in headers.items() if not k.startswith(':')}
-            
-            response = requests.post(
+        Raises:
+            requests.exceptions.RequestException: If the API request fails
+        """
+        with span("run_imagefx", node="imagefx"):
+            response = await async_client.post_authenticated(
                 "https://aisandbox-pa.googleapis.com/v1:runImageFx",
-                json=json_data,
-                headers=cleaned_headers,
-                cookies=self.cookies
+                self._get_cleaned_headers,
+                hedge=True,
+                dedupe=True,
+                json=json_data
             )
-            
-            response.raise_for_status()
             result = response.json()
 
-            pbar.update_absolute(50)
-
-            if "imagePanels" in result:
-                image_panel = result["imagePanels"][0]
-                images = []
-                response_seed = None
-                
-                for img_data in image_panel["generatedImages"]:
-                    try:
-                        encoded_image = img_data["encodedImage"]
-                        if response_seed is None:
-                            response_seed = img_data.get("seed", seed)
-                        
-                        # Decode base64 to bytes
-                        if "," in encoded_image:
-                            encoded_image = encoded_image.split(",", 1)[1]
-                        image_bytes = base64.b64decode(encoded_image)
-                        
-                        # Convert to PIL Image
-                        pil_image = Image.open(BytesIO(image_bytes))
-                        img_tensor = pil2tensor(pil_image)
-                        images.append(img_tensor)
-                        
-                        pbar.update_absolute(50 + (40 * len(images) // num_images))
-                        
-                    except Exception as e:
-                        print(f"Error processing image: {str(e)}")
-                
-                if images:
-                    # Combine all images into a single tensor with shape [N, H, W, 3]
-                    combined_tensor = torch.cat(images, dim=0)
-                    pbar.update_absolute(100)
-                    return (combined_tensor, str(response_seed))
-                
-            # Return empty tensor with correct shape if no valid images
-            pbar.update_absolute(100)
-            return (torch.zeros((num_images, 512, 512, 3)), str(seed))
-
-        except requests.exceptions.RequestException as e:
-            print(f"API request error: {str(e)}")
-            if hasattr(e.response, 'text'):
-                print(f"Response content: {e.response.text}")
-            return (torch.zeros((num_images, 512, 512, 3)), str(seed))
+        encoded_images = []
+        response_seed = None
+
+        if "imagePanels" in result:
+            image_panel = result["imagePanels"][0]
+
+            for img_data in image_panel["generatedImages"]:
+                if "encodedImage" not in img_data:
+                    print("Error processing image: missing encodedImage")
+                    continue
+                if response_seed is None:
+                    response_seed = img_data.get("seed", seed)
+                encoded_images.append(img_data["encodedImage"])
+
+        return encoded_images, (seed if response_seed is None else response_seed)
+
+    async def _fetch_images(self, json_data: dict, seed: int, use_cache: bool = False,
+                            max_output_edge: int = 0, archive: bool = False) -> Tuple[List["Image.Image"], int]:
+        """
+        Return the decoded images and the response seed, serving from the
+        result cache when enabled. Images stay compact uint8 PIL images until
+        the caller builds the final output tensor in one allocation. With
+        archive set, freshly generated images are also written to the archive.
+
+        Raises:
+            requests.exceptions.RequestException: If the API request fails
+            auth.CredentialsExpiredError: On a cache miss when every token has expired
+            auth.CredentialsUnavailableError: On a cache miss when every account was rejected
+        """
+        cache_key = request_key(json_data) if use_cache else None
+        cached = None
+        if cache_key is not None:
+            with span("result_cache_lookup", node="imagefx") as info:
+                cached = await async_client.to_thread(result_cache.get, cache_key)
+                info["hit"] = cached is not None
+
+        if cached is not None:
+            encoded_images, response_seed = cached["images"], cached["seed"]
+        else:
+            # Cached results need no token; only a miss fails early when
+            # every token is known to be expired or rejected
+            credential_pool.ensure_usable()
+            encoded_images, response_seed = await self._request_images(json_data, seed)
+
+        store_key = cache_key if cached is None else None
+        archive_fields = None
+        if archive and cached is None:
+            archive_fields = {
+                "node": "imagefx",
+                "prompt": json_data["userInput"]["prompts"][0],
+                "seed": response_seed,
+                "aspect_ratio": json_data["aspectRatio"],
+            }
+        images = await async_client.to_thread(self._decode_and_store, encoded_images, store_key, response_seed,
+                                              max_output_edge, archive_fields)
+        return images, response_seed
+
+    def _decode_and_store(self, encoded_images: List[Union[str, bytes]], cache_key: Optional[str],
+                          response_seed, max_output_edge: int = 0,
+                          archive_fields: Optional[dict] = None) -> List["Image.Image"]:
+        from .utils import decode_images
+
+        # Candidates are decoded in parallel so their CPU time overlaps
+        with span("decode", node="imagefx") as info:
+            decoded = [item for item in decode_images(encoded_images, max_output_edge) if item is not None]
+            info["images"] = len(decoded)
+
+        if cache_key is not None and decoded:
+            # The cache keeps the original bytes so later runs can pick any output size
+            result_cache.put(cache_key, [image_bytes for image_bytes, _ in decoded], response_seed)
+
+        if archive_fields is not None and decoded:
+            with span("archive", node="imagefx"):
+                image_archive.add([image_bytes for image_bytes, _ in decoded], **archive_fields)
+
+        return [pil_image for _, pil_image in decoded]
+
+    async def _to_tensor(self, images: List["Image.Image"]) -> "torch.Tensor":
+        """Build the [N, H, W, 3] output with a single preallocated buffer"""
+        from .utils import pil2tensor
+
+        with span("to_tensor", node="imagefx"):
+            return await async_client.to_thread(pil2tensor, images)
+
+    def generate_image(self, prompt: str, seed: int, aspect_ratio: str, num_images: int = 4,
+                       use_cache: bool = False, max_output_edge: int = 0, archive: bool = False) -> Tuple["torch.Tensor", str]:
+        return async_client.run(self.generate_image_async(prompt, seed, aspect_ratio, num_images, use_cache,
+                                                          max_output_edge, archive))
+
+    async def generate_image_async(self, prompt: str, seed: int, aspect_ratio: str, num_images: int = 4,
+                                   use_cache: bool = False, max_output_edge: int = 0,
+                                   archive: bool = False) -> Tuple["torch.Tensor", str]:
+        with span("pipeline", node="imagefx"):
+            return await self._generate_image(prompt, seed, aspect_ratio, num_images, use_cache, max_output_edge,
+                                              archive)
+
+    async def _generate_image(self, prompt: str, seed: int, aspect_ratio: str, num_images: int,
+                              use_cache: bool, max_output_edge: int, archive: bool) -> Tuple["torch.Tensor", str]:
+        import comfy.utils
+
+        pbar = comfy.utils.ProgressBar(100)
+        session_id = f";{int(time.time() * 1000)}"
+        api_aspect_ratio = self._get_api_aspect_ratio(aspect_ratio)
+
+        json_data = self._build_request(prompt, seed, api_aspect_ratio, num_images, session_id)
+
+        pbar.update_absolute(20)
+
+        # Request failures are retried by the HTTP layer and raised once
+        # exhausted, so ComfyUI reports them instead of returning blank images.
+        images, response_seed = await self._fetch_images(json_data, seed, use_cache, max_output_edge, archive)
+
+        if not images:
+            raise RuntimeError("runImageFx returned no valid images")
+
+        pbar.update_absolute(90)
+        combined_tensor = await self._to_tensor(images)
+
+        pbar.update_absolute(100)
+        return (combined_tensor, str(response_seed))
+
+
+def parse_prompt_batch(prompts: str, base_seed: int) -> List[dict]:
+    """
+    Parse batch node input into jobs.
+
+    Accepts either a JSON array (of strings, or of objects with "prompt" and
+    an optional "seed") or plain text with one prompt per line. Prompts
+    without an explicit seed get base_seed + their position.
+    """
+    text = prompts.strip()
+    entries = None
+    if text.startswith("["):
+        try:
+            entries = json.loads(text)
+        except ValueError:
+            entries = None
+
+    if entries is None:
+        entries = [line.strip() for line in text.splitlines() if line.strip()]
+
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            prompt = str(entry.get("prompt", "")).strip()
+            seed = entry.get("seed")
+        else:
+            prompt = str(entry).strip()
+            seed = None
+        if not prompt:
+            continue
+        jobs.append({
+            "index": len(jobs),
+            "prompt": prompt,
+            "seed": int(seed) if seed is not None else base_seed + len(jobs)
+        })
+    return jobs
+
+
+class ComfyUIImageFxBatchNode(ComfyUIImageFxNode):
+    @classmethod
+    def INPUT_TYPES(cls):
+        input_types = super().INPUT_TYPES()
+        input_types["required"] = {
+            "prompts": ("STRING", {"multiline": True}),
+            "seed": ("INT", {"default": 0, "min": 0, "max": 999999}),
+            "aspect_ratio": input_types["required"]["aspect_ratio"],
+            "num_images": ("INT", {"default": 1, "min": 1, "max": 4}),
+            "concurrency": ("INT", {"default": 4, "min": 1, "max": 32})
+        }
+        return input_types
+
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("generated_images", "metadata")
+    FUNCTION = "generate_batch_async" if async_client.NATIVE_ASYNC_NODES else "generate_batch"
+    CATEGORY = "comfyui-labs-google"
+
+    async def _run_job(self, job: dict, api_aspect_ratio: str, num_images: int, use_cache: bool,
+                       max_output_edge: int, archive: bool, semaphore: asyncio.Semaphore) -> dict:
+        session_id = f";{int(time.time() * 1000)}"
+        json_data = self._build_request(job["prompt"], job["seed"], api_aspect_ratio, num_images, session_id)
+
+        result = {"index": job["index"], "prompt": job["prompt"], "seed": job["seed"], "images": []}
+        try:
+            async with semaphore:
+                result["images"], result["seed"] = await self._fetch_images(json_data, job["seed"], use_cache,
+                                                                            max_output_edge, archive)
         except Exception as e:
-            print(f"Error generating images: {str(e)}")
-            return (torch.zeros((num_images, 512, 512, 3)), str(seed))
+            print(f"Error generating images for prompt {job['index']}: {str(e)}")
+            result["error"] = str(e)
+        return result
+
+    def generate_batch(self, prompts: str, seed: int, aspect_ratio: str, num_images: int = 1,
+                       concurrency: int = 4, use_cache: bool = False, max_output_edge: int = 0,
+                       archive: bool = False) -> Tuple["torch.Tensor", str]:
+        return async_client.run(self.generate_batch_async(prompts, seed, aspect_ratio, num_images, concurrency, use_cache,
+                                                          max_output_edge, archive))
+
+    async def generate_batch_async(self, prompts: str, seed: int, aspect_ratio: str, num_images: int = 1,
+                                   concurrency: int = 4, use_cache: bool = False,
+                                   max_output_edge: int = 0, archive: bool = False) -> Tuple["torch.Tensor", str]:
+        jobs = parse_prompt_batch(prompts, seed)
+        if not jobs:
+            raise ValueError("No prompts given")
+
+        import comfy.utils
+
+        pbar = comfy.utils.ProgressBar(len(jobs))
+        api_aspect_ratio = self._get_api_aspect_ratio(aspect_ratio)
+        results = [None] * len(jobs)
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        tasks = [self._run_job(job, api_aspect_ratio, num_images, use_cache, max_output_edge, archive, semaphore)
+                 for job in jobs]
+        for completed, task in enumerate(asyncio.as_completed(tasks), start=1):
+            result = await task
+            results[result["index"]] = result
+            pbar.update_absolute(completed)
+
+        # Keep the output in prompt order regardless of completion order
+        images = []
+        metadata = []
+        batch_offset = 0
+        for result in results:
+            entry = {
+                "index": result["index"],
+                "prompt": result["prompt"],
+                "seed": result["seed"],
+                "batch_offset": batch_offset,
+                "num_images": len(result["images"])
+            }
+            if "error" in result:
+                entry["error"] = result["error"]
+            elif not result["images"]:
+                entry["error"] = "runImageFx returned no valid images"
+            images.extend(result["images"])
+            batch_offset += entry["num_images"]
+            metadata.append(entry)
+
+        if not images:
+            raise RuntimeError(f"Every prompt in the batch failed, first error: {metadata[0]['error']}")
+
+        # Decoded images are held as uint8 until here, then written straight
+        # into one preallocated float tensor instead of concatenating batches
+        return (await self._to_tensor(images), json.dumps(metadata, ensure_ascii=False))
 
 
 NODE_CLASS_MAPPINGS = {
-    "ComfyUI-ImageFx": ComfyUIImageFxNode
+    "ComfyUI-ImageFx": ComfyUIImageFxNode,
+    "ComfyUI-ImageFx-Batch": ComfyUIImageFxBatchNode
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "ComfyUI-ImageFx": "ComfyUI-ImageFx🖼️"
+    "ComfyUI-ImageFx": "ComfyUI-ImageFx🖼️",
+    "ComfyUI-ImageFx-Batch": "ComfyUI-ImageFx-Batch🖼️"
 }
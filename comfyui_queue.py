@@ -0,0 +1,115 @@
+import json
+import time
+from typing import TYPE_CHECKING, Tuple
+from .metrics import span
+from .job_queue import job_queue, ensure_worker
+from .comfyui_imagefx import ASPECT_RATIOS, parse_prompt_batch
+
+if TYPE_CHECKING:
+    import torch
+
+
+class QueueSubmitNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "prompts": ("STRING", {"multiline": True}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 999999}),
+                "aspect_ratio": (list(ASPECT_RATIOS), {"default": "16:9 (Landscape)"}),
+                "num_images": ("INT", {"default": 4, "min": 1, "max": 4}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("job_ids",)
+    FUNCTION = "submit"
+    CATEGORY = "comfyui-labs-google"
+
+    def submit(self, prompts: str, seed: int, aspect_ratio: str, num_images: int) -> Tuple[str]:
+        jobs = parse_prompt_batch(prompts, seed)
+        if not jobs:
+            raise ValueError("No prompts given")
+
+        # Submitting is idempotent: jobs already queued or done keep their state
+        job_ids = [job_queue.submit({"node": "imagefx", "prompt": job["prompt"], "seed": job["seed"],
+                                     "aspect_ratio": aspect_ratio, "num_images": num_images})
+                   for job in jobs]
+        ensure_worker()
+        return (json.dumps(job_ids),)
+
+
+class QueueResultsNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "job_ids": ("STRING", {"forceInput": True}),
+                "timeout": ("INT", {"default": 600, "min": 0, "max": 86400}),
+            },
+            "optional": {
+                "max_output_edge": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("images", "metadata")
+    FUNCTION = "load_results"
+    CATEGORY = "comfyui-labs-google"
+
+    @classmethod
+    def IS_CHANGED(cls, job_ids=None, **kwargs):
+        # Re-run while jobs progress, so a result cut short by the timeout
+        # isn't served from ComfyUI's cache once the rest have finished
+        try:
+            jobs = job_queue.get(json.loads(job_ids))
+        except (TypeError, ValueError):
+            return float("nan")
+        return json.dumps([(job["id"], job["status"], job["updated"]) if job else None for job in jobs])
+
+    def load_results(self, job_ids: str, timeout: int, max_output_edge: int = 0) -> Tuple["torch.Tensor", str]:
+        from .utils import pil2tensor
+        from .archive import image_archive
+
+        job_ids = json.loads(job_ids)
+        # Results may have been queued before a restart; make sure they drain
+        ensure_worker()
+
+        deadline = time.monotonic() + timeout
+        with span("queue_wait", node="queue"):
+            while True:
+                jobs = job_queue.get(job_ids)
+                if all(job is None or job["status"] in ("done", "failed") for job in jobs):
+                    break
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(1.0)
+
+        images = []
+        metadata = []
+        for job_id, job in zip(job_ids, jobs):
+            entry = {"id": job_id, "status": job["status"] if job else "unknown"}
+            if job is not None:
+                entry.update(prompt=job["payload"].get("prompt", ""), error=job["error"])
+                if job["status"] == "done":
+                    entry.update(job["result"], batch_offset=len(images))
+                    images.extend(image_archive.open_image({"file": name}, max_output_edge)
+                                  for name in job["result"]["files"])
+            metadata.append(entry)
+
+        if not images:
+            raise RuntimeError(f"No queued job has finished yet: {json.dumps(metadata, ensure_ascii=False)}")
+
+        with span("to_tensor", node="queue"):
+            return (pil2tensor(images), json.dumps(metadata, ensure_ascii=False))
+
+
+NODE_CLASS_MAPPINGS = {
+    "ComfyUI-ImageFx-Queue-Submit": QueueSubmitNode,
+    "ComfyUI-ImageFx-Queue-Results": QueueResultsNode
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "ComfyUI-ImageFx-Queue-Submit": "ComfyUI-ImageFx-Queue-Submit📥",
+    "ComfyUI-ImageFx-Queue-Results": "ComfyUI-ImageFx-Queue-Results📤"
+}
@@ -1,72 +1,66 @@
-import os
 import json
 import base64
-import requests
-from io import BytesIO
-import numpy as np
-import torch
 import uuid
 import time
-from PIL import Image, UnidentifiedImageError
-from typing import List, Union
-import comfy.utils
-from .utils import pil2tensor, tensor2pil
-import chardet
+from . import async_client
+from .metrics import span
+from .auth import credential_pool
+from .caption_cache import caption_cache, caption_key, image_signatures, storyboard_cache, storyboard_key
+from .comfyui_imagefx import ASPECT_RATIOS
+from .archive import image_archive
+import asyncio
+
+# Upload formats offered by the node, see utils.UPLOAD_FORMATS. Listed here
+# so INPUT_TYPES doesn't import torch and PIL at ComfyUI startup.
+UPLOAD_FORMAT_NAMES = ["JPEG", "WEBP"]
+
+# runImageFx returns at most IMAGES_PER_CALL candidates; larger requests are
+# split into parallel calls.
+IMAGES_PER_CALL = 4
+MAX_IMAGES = 16
+
+# (input name, caption category, payload key) for each reference slot, in
+# the index order expected by the Whisk API.
+WHISK_SLOTS = (
+    ("subject_image", "CHARACTER", "characters"),
+    ("scene_image", "LOCATION", "location"),
+    ("style_image", "STYLE", "style"),
+)
 
-class WhiskNode:
-    def __init__(self):
-        self._initialize_auth()
-
-    def _initialize_auth(self):
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            config_file_path = os.path.join(current_dir, 'googel.json')
-
-            with open(config_file_path, 'rb') as file:
-                content = file.read()
-                encoding = chardet.detect(content)['encoding']
-
-            with open(config_file_path, 'r', encoding=encoding) as f:
-                self.auth_config = json.load(f)
-
-            self.access_token = self.auth_config.get('access_token')
-            self.user = self.auth_config.get('user', {})
-            self.expires = self.auth_config.get('expires')
-            self.cookies = {cookie['name']: cookie['value'] for cookie in self.auth_config.get('cookies', [])}
-
-            if not self.access_token:
-                raise ValueError("Access token not found in googel.json")
-
-        except Exception as e:
-            print(f"Authentication initialization error: {str(e)}")
-            raise
 
+class WhiskNode:
     @classmethod
     def INPUT_TYPES(cls):
         return {
             "required": {
                 "prompt": ("STRING", {"multiline": True}),
-                "num_images": ("INT", {"default": 2, "min": 1, "max": 4}),
+                "num_images": ("INT", {"default": 2, "min": 1, "max": MAX_IMAGES}),
                 "seed": ("INT", {"default": 0, "min": 0, "max": 2147483647}),
             },
             "optional": {
                 "subject_image": ("IMAGE",),
                 "scene_image": ("IMAGE",),
                 "style_image": ("IMAGE",),
+                "upload_max_edge": ("INT", {"default": 1024, "min": 0, "max": 8192, "step": 64}),
+                "upload_format": (UPLOAD_FORMAT_NAMES, {"default": "JPEG"}),
+                "upload_quality": ("INT", {"default": 85, "min": 1, "max": 100}),
+                "max_output_edge": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64}),
+                "archive": ("BOOLEAN", {"default": False}),
+                "aspect_ratio": (list(ASPECT_RATIOS), {"default": "16:9 (Landscape)"}),
             }
         }
 
-    RETURN_TYPES = ("IMAGE", "STRING", "STRING", "STRING", "STRING")
-    RETURN_NAMES = ("generated_images", "subject_prompt", "scene_prompt", "style_prompt", "prompts")
-    FUNCTION = "generate_image"
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING", "STRING", "STRING", "STRING")
+    RETURN_NAMES = ("generated_images", "subject_prompt", "scene_prompt", "style_prompt", "prompts", "metadata")
+    FUNCTION = "generate_image_async" if async_client.NATIVE_ASYNC_NODES else "generate_image"
     CATEGORY = "comfyui-labs-google"
 
-    def _get_headers(self):
+    def _get_headers(self, access_token):
         return {
             "accept": "*/*",
             "accept-encoding": "gzip, deflate, br, zstd",
             "accept-language": "zh-CN,zh;q=0.9,en;q=0.8",
-            "authorization": f"Bearer {self.access_token}",
+            "authorization": f"Bearer {access_token}",
             "content-type": "application/json",
             "origin": "https://labs.google",
             "referer": "https://labs.google/fx/zh/tools/whisk",
@@ -79,10 +73,8 @@ class WhiskNode:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
         }
 
-    def _generate_caption(self, image_data, category, session_id):
+    async def _generate_caption(self, image_data, category, session_id):
         """Generate caption for a single image"""
-        headers = self._get_headers()
-
         caption_json_data = {
             "json": {
                 "category": category,
@@ -91,37 +83,42 @@ class WhiskNode:
             }
         }
 
-        try:
-            caption_response = requests.post(
+        with span("caption", node="whisk", category=category):
+            caption_response = await async_client.post_authenticated(
                 "https://labs.google/fx/api/trpc/backbone.generateCaption",
-                json=caption_json_data,
-                headers=headers,
-                cookies=self.cookies
+                self._get_headers,
+                dedupe=True,
+                json=caption_json_data
             )
-            caption_response.raise_for_status()
-
             result = caption_response.json()
-            if "result" in result and "data" in result["result"] and "json" in result["result"]["data"]:
-                return result["result"]["data"]["json"]
-            else:
-                print(f"Error: Unexpected response format from generateCaption API for {category}")
-                return ""
-
-        except requests.exceptions.RequestException as e:
-            print(f"generateCaption API request error for {category}: {str(e)}")
+        if "result" in result and "data" in result["result"] and "json" in result["result"]["data"]:
+            return result["result"]["data"]["json"]
+        else:
+            print(f"Error: Unexpected response format from generateCaption API for {category}")
             return ""
 
-    def _extract_image_data(self, image_tensor, index):
-        """Extract image data and convert to base64"""
-        pil_image = tensor2pil(image_tensor)[0]  # Convert tensor to PIL image
-        image_bytes = self._pil_to_bytes(pil_image)
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+    def _extract_image_data(self, image_tensor, index, encode_options=None):
+        """Encode every image of a batch in one pass and convert to base64"""
+        from .utils import encode_images
+
+        with span("encode_reference", node="whisk", category=WHISK_SLOTS[index][1]) as info:
+            encoded = encode_images(image_tensor, **(encode_options or {}))
+            info["images"] = len(encoded)
+            info["bytes_out"] = sum(len(image_bytes) for _, image_bytes in encoded)
+
+        images_data = []
+        for mime_type, image_bytes in encoded:
+            base64_image = base64.b64encode(image_bytes).decode('utf-8')
+            images_data.append(self._build_image_data(f"data:{mime_type};base64,{base64_image}", index))
+        return images_data
 
+    def _build_image_data(self, base64_image, index):
+        """Wrap an encoded reference image in the Whisk media structure"""
         return {
             "imageId": f"image-{uuid.uuid4()}",
-            "category": ["CHARACTER", "LOCATION", "STYLE"][index],
+            "category": WHISK_SLOTS[index][1],
             "isPlaceholder": False,
-            "base64Image": f"data:image/jpeg;base64,{base64_image}",
+            "base64Image": base64_image,
             "index": index,
             "isUploading": False,
             "isLoading": False, 
@@ -129,13 +126,74 @@ class WhiskNode:
             "prompt": ""
         }
 
-    def _pil_to_bytes(self, image):
-        """Convert PIL image to bytes"""
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        return buffered.getvalue()
-
-    def _generate_payload(self, subject_image, scene_image, style_image, prompt, session_id, num_images):
+    async def _prepare_references(self, image_tensor, index, session_id, encode_options=None):
+        """
+        Encode the images of a reference batch and caption them, reusing
+        cached captions of the same pixels or, failing that, of a
+        near-duplicate (the same image resized or re-encoded upstream).
+        Exact hits also reuse the cached upload; every other image is
+        encoded in one batch so the storyboard request sends its own bytes,
+        and those without any cached caption are captioned concurrently.
+
+        Returns:
+            List of Whisk media dicts, one per image, in batch order
+        """
+        encode_options = encode_options or {}
+        category = WHISK_SLOTS[index][1]
+        variant = "-".join(str(encode_options[k]) for k in sorted(encode_options))
+        scope = f"{category}-{variant}"
+        if len(image_tensor.shape) <= 3:
+            image_tensor = image_tensor.unsqueeze(0)
+
+        def fingerprints():
+            keys = [caption_key(image_tensor[i:i + 1], category, variant) for i in range(image_tensor.shape[0])]
+            return keys, image_signatures(image_tensor)
+
+        cache_keys, signatures = await async_client.to_thread(fingerprints)
+
+        def lookup():
+            exact, near = [], []
+            for cache_key, signature in zip(cache_keys, signatures):
+                cached = caption_cache.get(cache_key)
+                exact.append(cached)
+                near.append(caption_cache.find_similar(signature, scope) if cached is None else None)
+            return exact, near
+
+        with span("caption_cache_lookup", node="whisk") as info:
+            exact, near = await async_client.to_thread(lookup)
+            info["hits"] = sum(entry is not None for entry in exact)
+            info["near_hits"] = sum(entry is not None for entry in near)
+
+        references = [None] * len(exact)
+        for i, entry in enumerate(exact):
+            if entry is not None:
+                references[i] = self._build_image_data(entry["base64Image"], index)
+                references[i]["prompt"] = entry["prompt"]
+
+        missing = [i for i, entry in enumerate(exact) if entry is None]
+        if not missing:
+            return references
+
+        batch = image_tensor if len(missing) == len(exact) else image_tensor[missing]
+        encoded = await async_client.to_thread(self._extract_image_data, batch, index, encode_options)
+
+        async def caption(i, image_data):
+            if near[i] is not None:
+                return near[i]["prompt"]
+            return await self._generate_caption(image_data, category, session_id)
+
+        captions = await asyncio.gather(*[caption(i, image_data) for i, image_data in zip(missing, encoded)])
+        for i, image_data, prompt in zip(missing, encoded, captions):
+            image_data["prompt"] = prompt
+            references[i] = image_data
+            if prompt:
+                await async_client.to_thread(
+                    caption_cache.put, cache_keys[i], {"prompt": prompt, "base64Image": image_data["base64Image"],
+                                                       "signature": signatures[i], "scope": scope})
+        return references
+
+    async def _generate_payload(self, subject_image, scene_image, style_image, prompt, session_id, num_images,
+                          encode_options=None):
         """Generate the payload based on provided input images"""
         payload_data = {
             "json": {
@@ -150,118 +208,102 @@ class WhiskNode:
             "meta": {}
         }
 
-        if subject_image is not None and scene_image is not None and style_image is not None:
-            subject_data = self._extract_image_data(subject_image, 0)
-            subject_prompt = self._generate_caption(subject_data, "CHARACTER", session_id)
-            subject_data["prompt"] = subject_prompt
-            payload_data["json"]["characters"].append(subject_data)
-
-            scene_data = self._extract_image_data(scene_image, 1)
-            scene_prompt = self._generate_caption(scene_data, "LOCATION", session_id)
-            scene_data["prompt"] = scene_prompt
-            payload_data["json"]["location"] = scene_data
-
-            style_data = self._extract_image_data(style_image, 2)
-            style_prompt = self._generate_caption(style_data, "STYLE", session_id)
-            style_data["prompt"] = style_prompt
-            payload_data["json"]["style"] = style_data
-
-            payload_data["meta"]["values"] = {"pose": ["undefined"]}
-
-        elif subject_image is not None and scene_image is not None:
-            subject_data = self._extract_image_data(subject_image, 0)
-            subject_prompt = self._generate_caption(subject_data, "CHARACTER", session_id)
-            subject_data["prompt"] = subject_prompt
-            payload_data["json"]["characters"].append(subject_data)
-
-            scene_data = self._extract_image_data(scene_image, 1)
-            scene_prompt = self._generate_caption(scene_data, "LOCATION", session_id)
-            scene_data["prompt"] = scene_prompt
-            payload_data["json"]["location"] = scene_data
-
-            payload_data["meta"]["values"] = {"style": ["undefined"], "pose": ["undefined"]}
-
-        elif subject_image is not None and style_image is not None:
-            subject_data = self._extract_image_data(subject_image, 0)  
-            subject_prompt = self._generate_caption(subject_data, "CHARACTER", session_id)
-            subject_data["prompt"] = subject_prompt
-            payload_data["json"]["characters"].append(subject_data)
-
-            style_data = self._extract_image_data(style_image, 2)
-            style_prompt = self._generate_caption(style_data, "STYLE", session_id)
-            style_data["prompt"] = style_prompt
-            payload_data["json"]["style"] = style_data
-
-            payload_data["meta"]["values"] = {"location": ["undefined"], "pose": ["undefined"]}
-
-        elif scene_image is not None and style_image is not None: 
-            scene_data = self._extract_image_data(scene_image, 1)
-            scene_prompt = self._generate_caption(scene_data, "LOCATION", session_id)
-            scene_data["prompt"] = scene_prompt
-            payload_data["json"]["location"] = scene_data
-
-            style_data = self._extract_image_data(style_image, 2)
-            style_prompt = self._generate_caption(style_data, "STYLE", session_id)
-            style_data["prompt"] = style_prompt  
-            payload_data["json"]["style"] = style_data
-
-            payload_data["meta"]["values"] = {"pose": ["undefined"]}
-
-        elif subject_image is not None:
-            subject_data = self._extract_image_data(subject_image, 0)
-            subject_prompt = self._generate_caption(subject_data, "CHARACTER", session_id)
-            subject_data["prompt"] = subject_prompt
-            payload_data["json"]["characters"].append(subject_data)
-
-            payload_data["meta"]["values"] = {"location": ["undefined"], "style": ["undefined"], "pose": ["undefined"]}
-
-        elif scene_image is not None:
-            scene_data = self._extract_image_data(scene_image, 1)
-            scene_prompt = self._generate_caption(scene_data, "LOCATION", session_id)
-            scene_data["prompt"] = scene_prompt
-            payload_data["json"]["location"] = scene_data
-
-            payload_data["meta"]["values"] = {"style": ["undefined"], "pose": ["undefined"]}
-
-        elif style_image is not None:
-            style_data = self._extract_image_data(style_image, 2)
-            style_prompt = self._generate_caption(style_data, "STYLE", session_id)
-            style_data["prompt"] = style_prompt
-            payload_data["json"]["style"] = style_data
+        images = {"subject_image": subject_image, "scene_image": scene_image, "style_image": style_image}
+        # Single [H, W, 3] images become batches of one, so slicing below takes whole images
+        images = {name: image.unsqueeze(0) if image is not None and len(image.shape) <= 3 else image
+                  for name, image in images.items()}
+        provided = [(index, slot) for index, slot in enumerate(WHISK_SLOTS) if images[slot[0]] is not None]
+        if not provided:
+            return payload_data
+
+        # Captions are independent of each other, so encode and caption all
+        # references concurrently and join before the storyboard request.
+        # Every image of the subject batch becomes a character; location and
+        # style take a single image, so only the first of those batches is used.
+        prepared = await asyncio.gather(*[
+            self._prepare_references(images[slot[0]] if slot[2] == "characters" else images[slot[0]][:1],
+                                     index, session_id, encode_options)
+            for index, slot in provided
+        ])
+        for (_, (_, _, payload_key)), references in zip(provided, prepared):
+            if payload_key == "characters":
+                payload_data["json"]["characters"].extend(references)
+            else:
+                payload_data["json"][payload_key] = references[0]
 
-            payload_data["meta"]["values"] = {"location": ["undefined"], "pose": ["undefined"]}
+        meta_values = {}
+        for key in ("location", "style"):
+            if payload_data["json"][key] is None:
+                meta_values[key] = ["undefined"]
+        meta_values["pose"] = ["undefined"]
+        payload_data["meta"]["values"] = meta_values
 
         return payload_data
 
-    def generate_image(self, prompt, subject_image=None, scene_image=None, style_image=None, num_images=2, seed=0):
-        pbar = comfy.utils.ProgressBar(100)
-        session_id = f";{int(time.time() * 1000)}"
-
-        payload_data = self._generate_payload(subject_image, scene_image, style_image, prompt, session_id, num_images)
-
-        pbar.update_absolute(30)
+    def generate_image(self, prompt, subject_image=None, scene_image=None, style_image=None, num_images=2, seed=0,
+                       upload_max_edge=1024, upload_format="JPEG", upload_quality=85, max_output_edge=0, archive=False,
+                       aspect_ratio="16:9 (Landscape)"):
+        return async_client.run(self.generate_image_async(prompt, subject_image, scene_image, style_image, num_images,
+                                                          seed, upload_max_edge, upload_format, upload_quality,
+                                                          max_output_edge, archive, aspect_ratio))
+
+    async def generate_image_async(self, prompt, subject_image=None, scene_image=None, style_image=None, num_images=2,
+                                   seed=0, upload_max_edge=1024, upload_format="JPEG", upload_quality=85,
+                                   max_output_edge=0, archive=False, aspect_ratio="16:9 (Landscape)"):
+        with span("pipeline", node="whisk"):
+            return await self._generate_image(prompt, subject_image, scene_image, style_image, num_images, seed,
+                                              upload_max_edge, upload_format, upload_quality, max_output_edge,
+                                              archive, aspect_ratio)
+
+    async def _generate_storyboard(self, payload_data):
+        """
+        Return the storyboard prompt for the captioned references, reusing
+        earlier results for the same captions and text.
+        """
+        json_data = payload_data["json"]
+        captions = {
+            "characters": [character["prompt"] for character in json_data["characters"]],
+            "location": json_data["location"]["prompt"] if json_data["location"] else None,
+            "style": json_data["style"]["prompt"] if json_data["style"] else None,
+        }
+        cache_key = storyboard_key(captions, json_data["additionalInput"])
+        with span("storyboard_cache_lookup", node="whisk") as info:
+            cached = await async_client.to_thread(storyboard_cache.get, cache_key)
+            info["hit"] = cached is not None
+        if cached is not None:
+            return cached["prompt"]
+
+        async def request():
+            with span("storyboard", node="whisk"):
+                storyboard_response = await async_client.post_authenticated(
+                    "https://labs.google/fx/api/trpc/backbone.generateStoryBoardPrompt",
+                    self._get_headers,
+                    json=payload_data
+                )
+                storyboard_result = storyboard_response.json()
+            if "result" in storyboard_result and "data" in storyboard_result["result"]:
+                return storyboard_result["result"]["data"]["json"]
+            raise RuntimeError("Unexpected response from generateStoryBoardPrompt API")
 
-        try:
-            storyboard_response = requests.post(
-                "https://labs.google/fx/api/trpc/backbone.generateStoryBoardPrompt",
-                json=payload_data,
-                headers=self._get_headers(),
-                cookies=self.cookies
-            )
-            storyboard_response.raise_for_status()
-            storyboard_result = storyboard_response.json()
+        # The payload carries fresh image ids every run, so identical
+        # storyboards in flight are joined on the caption key instead
+        storyboard_prompt = await async_client.single_flight.do(
+            cache_key, request, endpoint="backbone.generateStoryBoardPrompt")
 
-            if "result" in storyboard_result and "data" in storyboard_result["result"]:
-                storyboard_prompt = storyboard_result["result"]["data"]["json"]
-            else:
-                print("Error: Unexpected response from generateStoryBoardPrompt API")
-                storyboard_prompt = ""
+        # A failed caption comes back empty; don't pin a storyboard built on it
+        if all(caption for caption in [*captions["characters"], captions["location"], captions["style"]]
+               if caption is not None):
+            await async_client.to_thread(storyboard_cache.put, cache_key, {"prompt": storyboard_prompt})
+        return storyboard_prompt
 
-        except requests.exceptions.RequestException as e:
-            print(f"generateStoryBoardPrompt API request error: {str(e)}")
-            storyboard_prompt = ""
+    async def _render(self, storyboard_prompt, num_images, seed, session_id, api_aspect_ratio, max_output_edge):
+        """
+        Run one runImageFx call of up to IMAGES_PER_CALL candidates.
 
-        pbar.update_absolute(50)
+        Returns:
+            (decoded (bytes, PIL image) pairs, panel prompt, seed sent)
+        """
+        from .utils import decode_images
 
         imagefx_json_data = {
             "userInput": {
@@ -274,58 +316,131 @@ class WhiskNode:
                 "sessionId": session_id,
                 "tool": "BACKBONE"
             },
-            "aspectRatio": "IMAGE_ASPECT_RATIO_LANDSCAPE",
+            "aspectRatio": api_aspect_ratio,
             "modelInput": {
                 "modelNameType": "IMAGEN_3_1"
             }
         }
 
-        generated_images = torch.zeros((num_images, 512, 512, 3))
-        prompts = []
-
-        try:
-            imagefx_response = requests.post(
+        with span("run_imagefx", node="whisk"):
+            imagefx_response = await async_client.post_authenticated(
                 "https://aisandbox-pa.googleapis.com/v1:runImageFx",
-                json=imagefx_json_data,
-                headers=self._get_headers(),
-                cookies=self.cookies
+                self._get_headers,
+                hedge=True,
+                dedupe=True,
+                json=imagefx_json_data
             )
-            imagefx_response.raise_for_status()
             imagefx_result = imagefx_response.json()
 
-            if "imagePanels" in imagefx_result:
-                image_panel = imagefx_result["imagePanels"][0]
-                images = []
+        if "imagePanels" not in imagefx_result:
+            raise RuntimeError("No valid image panels in runImageFx response")
+
+        image_panel = imagefx_result["imagePanels"][0]
+        encoded_images = [img_data["encodedImage"] for img_data in image_panel["generatedImages"]]
+
+        # Candidates are decoded in parallel so their CPU time overlaps
+        with span("decode", node="whisk"):
+            decoded = await async_client.to_thread(decode_images, encoded_images, max_output_edge)
+        return (list(filter(None, decoded)), image_panel.get("prompt", ""),
+                imagefx_json_data["userInput"]["seed"])
+
+    async def _render_all(self, storyboard_prompt, num_images, seed, session_id, api_aspect_ratio, max_output_edge):
+        """
+        Render num_images candidates with parallel runImageFx calls of up to
+        IMAGES_PER_CALL each. One caption and storyboard pass feeds every
+        call; calls past the first use the following seeds so their
+        candidates differ.
+
+        Request failures are retried by the HTTP layer and raised once
+        exhausted. If every call fails the first error is raised; otherwise
+        the failed calls are reported in the metadata.
+
+        Returns:
+            (successful _render results in call order, metadata list with one
+            entry per call: seed, requested and returned counts, batch offset
+            and error if any)
+        """
+        counts = [min(IMAGES_PER_CALL, num_images - start) for start in range(0, num_images, IMAGES_PER_CALL)]
+        results = await asyncio.gather(*[
+            self._render(storyboard_prompt, count, seed + i, session_id, api_aspect_ratio, max_output_edge)
+            for i, count in enumerate(counts)
+        ], return_exceptions=True)
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if len(errors) == len(results):
+            raise errors[0]
+        if errors:
+            print(f"{len(errors)} of {len(counts)} runImageFx calls failed, first error: {str(errors[0])}")
+
+        renders = []
+        metadata = []
+        batch_offset = 0
+        for i, (count, result) in enumerate(zip(counts, results)):
+            entry = {"index": i, "seed": (seed + i) % 2147483647, "batch_offset": batch_offset, "requested": count}
+            metadata.append(entry)
+            if isinstance(result, BaseException):
+                entry.update(num_images=0, error=str(result))
+                continue
+
+            entry["num_images"] = len(result[0])
+            if not result[0]:
+                entry["error"] = "runImageFx returned no valid images"
+            batch_offset += entry["num_images"]
+            renders.append(result)
+        return renders, metadata
+
+    async def _generate_image(self, prompt, subject_image, scene_image, style_image, num_images, seed,
+                              upload_max_edge, upload_format, upload_quality, max_output_edge=0, archive=False,
+                              aspect_ratio="16:9 (Landscape)"):
+        import comfy.utils
+        from .utils import pil2tensor
+
+        # Fail before uploading anything if every token is already known to be expired
+        credential_pool.ensure_usable()
+        pbar = comfy.utils.ProgressBar(100)
+        session_id = f";{int(time.time() * 1000)}"
+        encode_options = {"max_edge": upload_max_edge, "image_format": upload_format, "quality": upload_quality}
+        api_aspect_ratio = ASPECT_RATIOS.get(aspect_ratio, "IMAGE_ASPECT_RATIO_LANDSCAPE")
 
-                for img_data in image_panel["generatedImages"]:
-                    encoded_image = img_data["encodedImage"]
-                    if "," in encoded_image:
-                        encoded_image = encoded_image.split(",", 1)[1]
+        with span("references", node="whisk"):
+            payload_data = await self._generate_payload(subject_image, scene_image, style_image, prompt, session_id,
+                                                        min(num_images, IMAGES_PER_CALL), encode_options)
 
-                    image_bytes = base64.b64decode(encoded_image)
-                    pil_image = Image.open(BytesIO(image_bytes))
-                    img_tensor = pil2tensor(pil_image)
-                    images.append(img_tensor)
+        pbar.update_absolute(30)
 
-                    prompt = image_panel.get("prompt", "")
-                    prompts.append(prompt)
+        storyboard_prompt = await self._generate_storyboard(payload_data)
 
-                if images:
-                    generated_images = torch.cat(images, dim=0)
-                else:
-                    print("Warning: No valid images generated")
-            else:
-                print("Warning: No valid image panels in response")
+        pbar.update_absolute(50)
+
+        renders, metadata = await self._render_all(storyboard_prompt, num_images, seed, session_id,
+                                                   api_aspect_ratio, max_output_edge)
 
-        except requests.exceptions.RequestException as e:
-            print(f"runImageFx API request error: {str(e)}")
+        images = []
+        prompts = []
+        for decoded, panel_prompt, render_seed in renders:
+            images.extend(pil_image for _, pil_image in decoded)
+            prompts.extend([panel_prompt] * len(decoded))
+            if archive and decoded:
+                with span("archive", node="whisk"):
+                    await async_client.to_thread(
+                        image_archive.add, [image_bytes for image_bytes, _ in decoded],
+                        node="whisk", prompt=prompt, storyboard_prompt=storyboard_prompt,
+                        seed=render_seed, aspect_ratio=api_aspect_ratio)
+        if not images:
+            raise RuntimeError("runImageFx returned no valid images")
+
+        pbar.update_absolute(90)
+
+        with span("to_tensor", node="whisk"):
+            generated_images = await async_client.to_thread(pil2tensor, images)
 
         pbar.update_absolute(100)
         return (generated_images, 
-                payload_data['json']['characters'][0]['prompt'] if payload_data['json']['characters'] else "", 
+                "\n".join(character['prompt'] for character in payload_data['json']['characters']), 
                 payload_data['json']['location']['prompt'] if payload_data['json']['location'] else "", 
                 payload_data['json']['style']['prompt'] if payload_data['json']['style'] else "", 
-                json.dumps(prompts))
+                json.dumps(prompts),
+                json.dumps(metadata, ensure_ascii=False))
 
 
 class WhiskPromptsNode:
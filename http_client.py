@@ -0,0 +1,128 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .limiter import ADAPTIVE_CONCURRENCY, MAX_LIMIT
+from .metrics import endpoint_name, metrics, span
+
+LABS_HOST = "https://labs.google/"
+AISANDBOX_HOST = "https://aisandbox-pa.googleapis.com/"
+
+# Number of per-host connection pools kept alive, connections kept per host,
+# and (connect, read) timeouts in seconds. All can be overridden through the
+# environment or at runtime with configure().
+POOL_CONNECTIONS = int(os.environ.get("LABS_GOOGLE_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("LABS_GOOGLE_POOL_MAXSIZE", 8))
+CONNECT_TIMEOUT = float(os.environ.get("LABS_GOOGLE_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("LABS_GOOGLE_READ_TIMEOUT", 180))
+
+# With adaptive concurrency the limiter is the only gate on API requests:
+# the API host pools keep a connection for every slot it can grant and
+# never block, so time spent queueing in urllib3 is never measured as API
+# latency. Without it, blocking pools cap concurrent requests per host.
+POOL_BLOCK = not ADAPTIVE_CONCURRENCY
+HOST_MAXSIZE = max(POOL_MAXSIZE, MAX_LIMIT) if ADAPTIVE_CONCURRENCY else POOL_MAXSIZE
+
+HOST_LIMITS: Dict[str, int] = {
+    LABS_HOST: int(os.environ.get("LABS_GOOGLE_LABS_MAXSIZE", HOST_MAXSIZE)),
+    AISANDBOX_HOST: int(os.environ.get("LABS_GOOGLE_AISANDBOX_MAXSIZE", HOST_MAXSIZE)),
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    # Cookies are passed explicitly with every request; never let Set-Cookie
+    # responses leak into the shared jar.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    default_adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+
+    for prefix, maxsize in HOST_LIMITS.items():
+        # A blocking pool caps concurrent connections per host instead of
+        # opening throwaway connections once the pool is exhausted.
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=maxsize, pool_block=POOL_BLOCK))
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_timeout() -> Tuple[float, float]:
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """POST through the shared session, applying the default timeouts and recording metrics"""
+    kwargs.setdefault("timeout", get_timeout())
+    endpoint = endpoint_name(url)
+
+    with span("http", endpoint=endpoint) as info:
+        try:
+            response = get_session().post(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            metrics.inc("labs_google_http_requests_total", endpoint=endpoint, status=type(e).__name__)
+            raise
+
+        body = response.request.body or b""
+        info["status"] = response.status_code
+        info["bytes_out"] = len(body)
+        info["bytes_in"] = len(response.content)
+
+    metrics.inc("labs_google_http_requests_total", endpoint=endpoint, status=response.status_code)
+    metrics.inc("labs_google_http_bytes_sent_total", info["bytes_out"], endpoint=endpoint)
+    metrics.inc("labs_google_http_bytes_received_total", info["bytes_in"], endpoint=endpoint)
+    return response
+
+
+def configure(pool_connections: Optional[int] = None,
+              pool_maxsize: Optional[int] = None,
+              host_limits: Optional[Dict[str, int]] = None,
+              connect_timeout: Optional[float] = None,
+              read_timeout: Optional[float] = None) -> None:
+    """
+    Update pool and timeout settings. The shared session is rebuilt lazily
+    on the next request so new pool sizes take effect.
+
+    Args:
+        pool_connections: Number of host pools to keep alive
+        pool_maxsize: Default connections kept per host
+        host_limits: Connections kept per host, keyed by URL prefix; also a
+            hard cap when adaptive concurrency is disabled (POOL_BLOCK)
+        connect_timeout: Seconds to wait for a TCP/TLS connection
+        read_timeout: Seconds to wait for response data
+    """
+    global POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_TIMEOUT, READ_TIMEOUT, _session
+
+    with _session_lock:
+        if pool_connections is not None:
+            POOL_CONNECTIONS = pool_connections
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = pool_maxsize
+        if host_limits is not None:
+            HOST_LIMITS.update(host_limits)
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+
+        old_session, _session = _session, None
+
+    if old_session is not None:
+        old_session.close()
@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from contextlib import closing
+from typing import Dict, List, Optional
+
+from .metrics import metrics
+
+QUEUE_DB = os.environ.get("LABS_GOOGLE_QUEUE_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite3")
+# Jobs run at once by a worker, and jobs started per minute (0 = unlimited).
+QUEUE_CONCURRENCY = int(os.environ.get("LABS_GOOGLE_QUEUE_CONCURRENCY", 2))
+QUEUE_RATE = float(os.environ.get("LABS_GOOGLE_QUEUE_RATE", 0))
+MAX_ATTEMPTS = int(os.environ.get("LABS_GOOGLE_QUEUE_ATTEMPTS", 3))
+# A running job whose worker hasn't renewed its lease for this many seconds
+# is assumed to belong to a worker that died and is handed out again.
+# Workers renew several times per lease while a job runs.
+LEASE_SECONDS = float(os.environ.get("LABS_GOOGLE_QUEUE_LEASE", 600))
+
+STATUSES = ("pending", "running", "done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    lease TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+
+def job_id(job: Dict) -> str:
+    """Stable id for a job, so submitting the same work twice queues it once"""
+    from .result_cache import request_key
+
+    return job.get("id") or request_key(job)[:16]
+
+
+class JobQueue:
+    """
+    Durable queue of generation jobs in a SQLite file.
+
+    Jobs are the dicts job_runner.JobRunner runs, as cli.py reads them from
+    JSONL. Each one moves through pending -> running -> done or failed, and
+    its result (seed, archive entries of the images) is stored with it, so
+    finished work survives a restart and is never generated twice.
+    """
+
+    def __init__(self, path: str = QUEUE_DB, max_attempts: int = MAX_ATTEMPTS, lease_seconds: float = LEASE_SECONDS):
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_SCHEMA)
+                        # Databases created before leases were tracked per claim
+                        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+                        if "lease" not in columns:
+                            conn.execute("ALTER TABLE jobs ADD COLUMN lease TEXT")
+                        conn.commit()
+                    self._initialized = True
+
+        # Autocommit; multi-statement changes open BEGIN IMMEDIATE themselves
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, job: Dict) -> str:
+        """
+        Queue a job unless the same job is already queued or done. A job
+        that previously failed is queued again with fresh attempts.
+
+        Returns:
+            str: The job id
+        """
+        job = dict(job)
+        job.setdefault("node", "imagefx")
+        job["id"] = job_id(job)
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, node, payload, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (job["id"], job.get("node", "imagefx"), json.dumps(job, ensure_ascii=False), now, now))
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, error = NULL, updated = ? "
+                "WHERE id = ? AND status = 'failed'", (now, job["id"]))
+        return job["id"]
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Mark the oldest runnable job as running and return it, or None if
+        there is none. The job's "lease" token must be passed back to
+        heartbeat, complete and fail; once the lease has expired and the job
+        was handed out again, the old token no longer matches.
+        """
+        now = time.time()
+        expired = now - self.lease_seconds
+        lease = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Worker stopped while running the job', updated = ? "
+                    "WHERE status = 'running' AND updated < ? AND attempts >= ?",
+                    (now, expired, self.max_attempts))
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'pending' OR (status = 'running' AND updated < ?) "
+                    "ORDER BY created LIMIT 1", (expired,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease = ?, updated = ? "
+                                 "WHERE id = ?", (lease, now, row["id"]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job.update(status="running", attempts=job["attempts"] + 1, lease=lease)
+        return job
+
+    def heartbeat(self, job: Dict) -> bool:
+        """Renew a claimed job's lease; False if the claim was lost"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("UPDATE jobs SET updated = ? WHERE id = ? AND status = 'running' AND lease = ?",
+                                  (time.time(), job["id"], job["lease"]))
+            return cursor.rowcount == 1
+
+    def complete(self, job: Dict, result: Dict) -> bool:
+        """Store a claimed job's result; False (and nothing stored) if the claim was lost"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease = NULL, updated = ? "
+                "WHERE id = ? AND status = 'running' AND lease = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job["id"], job["lease"]))
+            return cursor.rowcount == 1
+
+    def fail(self, job: Dict, error: str, count_attempt: bool = True) -> bool:
+        """
+        Record a failed run of a claimed job. The job goes back to pending
+        until it has used max_attempts; count_attempt=False returns it
+        without using one, for failures that say nothing about the job
+        itself (expired tokens). False if the claim was lost.
+        """
+        with closing(self._connect()) as conn:
+            if count_attempt:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "error = ?, lease = NULL, updated = ? WHERE id = ? AND status = 'running' AND lease = ?",
+                    (self.max_attempts, error, time.time(), job["id"], job["lease"]))
+            else:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), error = ?, lease = NULL, "
+                    "updated = ? WHERE id = ? AND status = 'running' AND lease = ?",
+                    (error, time.time(), job["id"], job["lease"]))
+            return cursor.rowcount == 1
+
+    def get(self, job_ids: List[str]) -> List[Optional[Dict]]:
+        """Jobs by id, in the given order; None for unknown ids"""
+        if not job_ids:
+            return []
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT * FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})",
+                                list(job_ids)).fetchall()
+        jobs = {row["id"]: self._to_dict(row) for row in rows}
+        return [jobs.get(job_id) for job_id in job_ids]
+
+    def counts(self) -> Dict[str, int]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+
+class QueueWorker:
+    """
+    Drains a JobQueue on the event loop with bounded concurrency and an
+    optional start rate. Images are stored in the image archive and the
+    job's result points at the archive entries.
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int = QUEUE_CONCURRENCY, jobs_per_minute: float = QUEUE_RATE,
+                 idle_delay: float = 2.0):
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.jobs_per_minute = jobs_per_minute
+        self.idle_delay = idle_delay
+        self.stopped = False
+
+    def _update_gauges(self) -> None:
+        for status, count in self.queue.counts().items():
+            metrics.set_gauge("labs_google_queue_jobs", count, status=status)
+
+    async def _heartbeat(self, job: Dict) -> None:
+        """Keep a running job's lease fresh so slow jobs aren't handed out twice"""
+        from . import async_client
+
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 4)
+            if not await async_client.to_thread(self.queue.heartbeat, job):
+                print(f"Queued job {job['id']} lost its lease; its result will be discarded")
+                return
+
+    async def _run(self, job: Dict, runner) -> None:
+        from . import async_client
+        from .archive import image_archive
+        from .auth import CredentialsExpiredError, CredentialsUnavailableError
+
+        payload = job["payload"]
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            images, details = await runner.execute(payload)
+            entries = await async_client.to_thread(
+                image_archive.add, images, node=payload["node"], prompt=payload.get("prompt", ""), **details)
+            if not entries:
+                raise RuntimeError("Could not write the images to the archive")
+            result = dict(details, images=[entry["id"] for entry in entries], files=[entry["file"] for entry in entries])
+            recorded = await async_client.to_thread(self.queue.complete, job, result)
+        except (CredentialsExpiredError, CredentialsUnavailableError) as e:
+            # Nothing will succeed until googel.json is updated; keep the job
+            print(f"Job queue paused: {str(e)}")
+            self.stopped = True
+            recorded = await async_client.to_thread(self.queue.fail, job, str(e), False)
+        except Exception as e:
+            print(f"Queued job {job['id']} failed (attempt {job['attempts']}/{self.queue.max_attempts}): {str(e)}")
+            recorded = await async_client.to_thread(self.queue.fail, job, str(e))
+        finally:
+            heartbeat.cancel()
+        if not recorded:
+            print(f"Queued job {job['id']} was claimed again after its lease expired; outcome not recorded")
+        await async_client.to_thread(self._update_gauges)
+
+    async def run(self, stop_when_empty: bool = False) -> None:
+        """Run jobs until stopped; with stop_when_empty, return once nothing is left to run"""
+        from . import async_client
+        from .auth import TokenBucket
+        from .job_runner import JobRunner
+
+        runner = JobRunner()
+        bucket = TokenBucket(self.jobs_per_minute, self.concurrency)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        def finished(task):
+            tasks.discard(task)
+            semaphore.release()
+
+        while not self.stopped:
+            await semaphore.acquire()
+            delay = bucket.wait_time(time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+
+            job = await async_client.to_thread(self.queue.claim)
+            if job is None:
+                semaphore.release()
+                if stop_when_empty and not tasks:
+                    break
+                await asyncio.sleep(self.idle_delay)
+                continue
+
+            bucket.take(time.monotonic())
+            task = asyncio.ensure_future(self._run(job, runner))
+            tasks.add(task)
+            task.add_done_callback(finished)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+job_queue = JobQueue()
+
+_worker_future = None
+_worker_lock = threading.Lock()
+
+
+def ensure_worker() -> None:
+    """Start draining job_queue on the background loop unless a worker is already running"""
+    global _worker_future
+    from . import async_client
+
+    with _worker_lock:
+        if _worker_future is None or _worker_future.done():
+            _worker_future = asyncio.run_coroutine_threadsafe(QueueWorker(job_queue).run(), async_client.get_loop())
@@ -0,0 +1,95 @@
+"""
+Runs one generation job, as read by cli.py from JSONL or stored in the job
+queue, through the same request, retry and decode code as the nodes.
+
+    {"node": "imagefx", "prompt": "a cat", "seed": 1, "aspect_ratio": "1:1 (Square)", "num_images": 4}
+    {"node": "whisk", "prompt": "on the moon", "subject_image": "refs/cat.png", "num_images": 8}
+"""
+import time
+import base64
+from typing import Dict, List, Tuple
+
+from . import async_client
+from .comfyui_imagefx import ASPECT_RATIOS, ComfyUIImageFxNode
+from .comfyui_whisk import IMAGES_PER_CALL, MAX_IMAGES, WhiskNode
+
+
+def load_reference(path: str):
+    """Reference image file as a [1, H, W, 3] tensor"""
+    from PIL import Image
+    from .utils import pil2tensor
+
+    with Image.open(path) as image:
+        return pil2tensor(image.convert("RGB"))
+
+
+class JobRunner:
+    def __init__(self):
+        self.imagefx = ComfyUIImageFxNode()
+        self.whisk = WhiskNode()
+
+    async def _run_imagefx(self, job: Dict) -> Tuple[List[bytes], Dict]:
+        seed = int(job.get("seed", 0))
+        json_data = self.imagefx._build_request(
+            job["prompt"], seed, ASPECT_RATIOS.get(job.get("aspect_ratio", "16:9 (Landscape)"),
+                                                   "IMAGE_ASPECT_RATIO_LANDSCAPE"),
+            int(job.get("num_images", 4)), f";{int(time.time() * 1000)}")
+        encoded_images, response_seed = await self.imagefx._request_images(json_data, seed)
+        if not encoded_images:
+            raise RuntimeError("runImageFx returned no valid images")
+
+        # The API's bytes are returned as-is; nothing is decoded
+        images = [base64.b64decode(encoded.split(",", 1)[-1]) for encoded in encoded_images]
+        return images, {"seed": response_seed, "aspect_ratio": json_data["aspectRatio"]}
+
+    async def _run_whisk(self, job: Dict) -> Tuple[List[bytes], Dict]:
+        # Files are decoded once per job and dropped with it; full-size float
+        # tensors are too large to keep across a long run, and repeated
+        # references still skip captioning through the caption cache
+        loaded = {}
+        references = {}
+        for name in ("subject_image", "scene_image", "style_image"):
+            path = job.get(name)
+            if path:
+                if path not in loaded:
+                    loaded[path] = await async_client.to_thread(load_reference, path)
+                references[name] = loaded[path]
+
+        num_images = min(int(job.get("num_images", 4)), MAX_IMAGES)
+        seed = int(job.get("seed", 0))
+        session_id = f";{int(time.time() * 1000)}"
+        api_aspect_ratio = ASPECT_RATIOS.get(job.get("aspect_ratio", "16:9 (Landscape)"),
+                                             "IMAGE_ASPECT_RATIO_LANDSCAPE")
+        encode_options = {"max_edge": int(job.get("upload_max_edge", 1024)), "image_format": "JPEG",
+                          "quality": int(job.get("upload_quality", 85))}
+
+        payload_data = await self.whisk._generate_payload(
+            references.get("subject_image"), references.get("scene_image"), references.get("style_image"),
+            job["prompt"], session_id, min(num_images, IMAGES_PER_CALL), encode_options)
+        storyboard_prompt = await self.whisk._generate_storyboard(payload_data)
+
+        renders, metadata = await self.whisk._render_all(storyboard_prompt, num_images, seed, session_id,
+                                                         api_aspect_ratio, 0)
+        images = [image_bytes for decoded, _, _ in renders for image_bytes, _ in decoded]
+        if not images:
+            raise RuntimeError("runImageFx returned no valid images")
+        details = {"seed": seed, "aspect_ratio": api_aspect_ratio, "storyboard_prompt": storyboard_prompt}
+        errors = [entry["error"] for entry in metadata if "error" in entry]
+        if errors:
+            details["errors"] = errors
+        return images, details
+
+    async def execute(self, job: Dict) -> Tuple[List[bytes], Dict]:
+        """
+        Run one job.
+
+        Returns:
+            (encoded image bytes list, details dict with seed, aspect_ratio
+            and, for Whisk, storyboard_prompt plus the errors of any
+            runImageFx calls that failed)
+        """
+        if job["node"] == "imagefx":
+            return await self._run_imagefx(job)
+        if job["node"] == "whisk":
+            return await self._run_whisk(job)
+        raise ValueError(f"Unknown node '{job['node']}'")
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from .metrics import endpoint_name, metrics
+
+# Adaptive limits on in-flight requests per endpoint. The limit starts at
+# INITIAL_LIMIT, grows by one per round trip while the endpoint keeps up and
+# is cut by BACKOFF on 429/5xx/timeouts or when recent latency exceeds
+# LATENCY_TOLERANCE times the long-run average.
+ADAPTIVE_CONCURRENCY = os.environ.get("LABS_GOOGLE_ADAPTIVE_CONCURRENCY", "1") == "1"
+INITIAL_LIMIT = int(os.environ.get("LABS_GOOGLE_CONCURRENCY_INITIAL", 4))
+MIN_LIMIT = int(os.environ.get("LABS_GOOGLE_CONCURRENCY_MIN", 1))
+MAX_LIMIT = int(os.environ.get("LABS_GOOGLE_CONCURRENCY_MAX", 32))
+BACKOFF = float(os.environ.get("LABS_GOOGLE_CONCURRENCY_BACKOFF", 0.5))
+LATENCY_TOLERANCE = float(os.environ.get("LABS_GOOGLE_CONCURRENCY_LATENCY_TOLERANCE", 2.0))
+
+# Smoothing of the short (recent) and long (baseline) latency averages, and
+# samples needed before latency alone may shrink the limit.
+SHORT_ALPHA = 0.3
+LONG_ALPHA = 0.05
+MIN_SAMPLES = 10
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one endpoint.
+
+    Waiters are thread-safe futures, so coroutines on the background loop
+    and on ComfyUI's own loop share the same limit.
+    """
+
+    def __init__(self, name: str, initial: int = INITIAL_LIMIT, min_limit: int = MIN_LIMIT,
+                 max_limit: int = MAX_LIMIT, backoff: float = BACKOFF, tolerance: float = LATENCY_TOLERANCE):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self.samples = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[Future] = deque()
+        self._lock = threading.Lock()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("labs_google_concurrency_limit", int(self.limit), endpoint=self.name)
+        metrics.set_gauge("labs_google_concurrency_in_flight", self.in_flight, endpoint=self.name)
+        metrics.set_gauge("labs_google_concurrency_queue_depth", len(self._waiters), endpoint=self.name)
+
+    def _grant_waiters(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            # Skips waiters whose caller was cancelled while queued
+            if waiter.set_running_or_notify_cancel():
+                self.in_flight += 1
+                try:
+                    waiter.set_result(None)
+                except InvalidStateError:
+                    pass
+
+    def _decrease(self, now: float) -> None:
+        # At most one cut per round trip, so a burst of failures from the
+        # same window doesn't collapse the limit to the minimum.
+        if now - self._last_decrease < (self.short_latency or 0.0):
+            return
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self._last_decrease = now
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                self._publish()
+                return
+            waiter = Future()
+            self._waiters.append(waiter)
+            self._publish()
+
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            # Withdraw from the queue; if the slot was granted meanwhile, give it back
+            waiter.cancel()
+            if not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Return a slot, feeding back how the request went.
+
+        Args:
+            latency: Seconds a successful request took, None if it failed
+            overloaded: The request failed with a sign of overload (429, 5xx, timeout)
+        """
+        with self._lock:
+            saturated = self.in_flight >= int(self.limit) or bool(self._waiters)
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            if overloaded:
+                self._decrease(now)
+            elif latency is not None:
+                self.samples += 1
+                if self.short_latency is None:
+                    self.short_latency = self.long_latency = latency
+                else:
+                    self.short_latency += SHORT_ALPHA * (latency - self.short_latency)
+                    self.long_latency += LONG_ALPHA * (latency - self.long_latency)
+
+                if self.samples >= MIN_SAMPLES and self.short_latency > self.tolerance * self.long_latency:
+                    self._decrease(now)
+                elif saturated:
+                    # Additive increase: about +1 per limit's worth of successes
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            self._grant_waiters()
+            self._publish()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot around one request and feed back its outcome"""
+        from .retry import retry_policy
+
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(overloaded=retry_policy.is_retryable(e))
+            raise
+        else:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "short_latency": self.short_latency,
+                "long_latency": self.long_latency,
+            }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url: str) -> Optional[AdaptiveLimiter]:
+    """Limiter for the endpoint of url, or None when adaptive concurrency is disabled"""
+    if not ADAPTIVE_CONCURRENCY:
+        return None
+    name = endpoint_name(url)
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name)
+        return _limiters[name]
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import math
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Setting a path appends one JSON line per recorded span.
+TRACE_FILE = os.environ.get("LABS_GOOGLE_TRACE_FILE") or None
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Process-wide counters, gauges and histograms with Prometheus text export"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": {name: {str(dict(k)): v for k, v in series.items()} for name, series in self._counters.items()},
+                "gauges": {name: {str(dict(k)): v for k, v in series.items()} for name, series in self._gauges.items()},
+                "histograms": {
+                    name: {str(dict(k)): {"count": h.count, "sum": h.sum} for k, h in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if math.isinf(bound) else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+_trace_lock = threading.Lock()
+
+
+def _write_trace(record: Dict) -> None:
+    with _trace_lock:
+        try:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Trace write error: {str(e)}")
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """
+    Time a pipeline stage into the labs_google_stage_seconds histogram.
+
+    The yielded dict can be filled with extra fields (byte counts, status)
+    that are written to the JSONL trace alongside the timing.
+    """
+    info: Dict = {}
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield info
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.observe("labs_google_stage_seconds", seconds, stage=stage, outcome=outcome, **labels)
+        if TRACE_FILE:
+            _write_trace({"ts": time.time(), "stage": stage, "seconds": seconds, "outcome": outcome, **labels, **info})
+
+
+def endpoint_name(url: str) -> str:
+    """Short label for an API URL, e.g. "v1:runImageFx" or "backbone.generateCaption" """
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def register_routes() -> None:
+    """Expose /labs_google/metrics (Prometheus text) when running inside ComfyUI"""
+    try:
+        from aiohttp import web
+        from server import PromptServer
+    except ImportError:
+        return
+
+    if getattr(PromptServer, "instance", None) is None:
+        return
+
+    @PromptServer.instance.routes.get("/labs_google/metrics")
+    async def labs_google_metrics(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
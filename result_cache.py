@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+CACHE_DIR = os.environ.get("LABS_GOOGLE_RESULT_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "imagefx")
+MAX_BYTES = int(os.environ.get("LABS_GOOGLE_RESULT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Seconds a cached result stays valid; 0 keeps results until evicted for space.
+TTL = float(os.environ.get("LABS_GOOGLE_RESULT_CACHE_TTL", 7 * 24 * 3600))
+
+# Fields that change on every call without affecting the result: the
+# runImageFx session id and the one inside tRPC ({"json": ...}) bodies.
+_VOLATILE_FIELDS = (("clientContext", "sessionId"), ("json", "sessionId"))
+
+
+def request_key(json_data: Dict) -> str:
+    """
+    Canonical hash of a runImageFx or tRPC payload.
+
+    Args:
+        json_data: Request body sent to the API
+
+    Returns:
+        str: Hex digest that is stable across sessions for identical requests
+    """
+    payload = json.loads(json.dumps(json_data))
+    for section, field in _VOLATILE_FIELDS:
+        if isinstance(payload.get(section), dict):
+            payload[section].pop(field, None)
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of generated images keyed by request fingerprint.
+
+    Each entry is a directory holding the encoded image bytes exactly as the
+    API returned them plus a meta.json. Entries are evicted least recently
+    used first once the cache grows past max_bytes, and expire after ttl.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_BYTES, ttl: float = TTL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sizes: Optional[Dict[str, int]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load_sizes(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self._sizes = {}
+            if os.path.isdir(self.cache_dir):
+                for key in os.listdir(self.cache_dir):
+                    entry_dir = self._entry_dir(key)
+                    if os.path.isdir(entry_dir):
+                        self._sizes[key] = sum(
+                            os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+        return self._sizes
+
+    def _remove(self, key: str) -> None:
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        self._load_sizes().pop(key, None)
+
+    def _evict(self) -> None:
+        sizes = self._load_sizes()
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        def last_used(key):
+            try:
+                return os.path.getmtime(os.path.join(self._entry_dir(key), "meta.json"))
+            except OSError:
+                return 0.0
+
+        for key in sorted(sizes, key=last_used):
+            if total <= self.max_bytes:
+                break
+            total -= sizes[key]
+            self._remove(key)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return {"seed", "images": [bytes, ...]} for a cached request, or None"""
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+
+        with self._lock:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+
+                if self.ttl and time.time() - meta["created"] > self.ttl:
+                    self._remove(key)
+                    self.misses += 1
+                    return None
+
+                images = []
+                for name in meta["files"]:
+                    with open(os.path.join(entry_dir, name), 'rb') as f:
+                        images.append(f.read())
+
+                # Touch the entry so eviction sees it as recently used.
+                os.utime(meta_path)
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return {"seed": meta.get("seed"), "images": images}
+
+    def put(self, key: str, images: List[bytes], seed=None) -> None:
+        if not images:
+            return
+
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{threading.get_ident()}.tmp"
+
+        with self._lock:
+            try:
+                os.makedirs(tmp_dir, exist_ok=True)
+                files = []
+                for i, image_bytes in enumerate(images):
+                    name = f"{i}.bin"
+                    with open(os.path.join(tmp_dir, name), 'wb') as f:
+                        f.write(image_bytes)
+                    files.append(name)
+
+                with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+                    json.dump({"created": time.time(), "seed": seed, "files": files}, f)
+
+                self._remove(key)
+                os.replace(tmp_dir, entry_dir)
+            except OSError as e:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                print(f"Result cache write error: {str(e)}")
+                return
+
+            self._load_sizes()[key] = sum(len(image_bytes) for image_bytes in images)
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            sizes = self._load_sizes()
+            return {
+                "entries": len(sizes),
+                "bytes": sum(sizes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,148 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional, TypeVar
+
+if TYPE_CHECKING:
+    import requests
+
+MAX_ATTEMPTS = int(os.environ.get("LABS_GOOGLE_RETRY_ATTEMPTS", 4))
+BASE_DELAY = float(os.environ.get("LABS_GOOGLE_RETRY_BASE_DELAY", 1.0))
+MAX_DELAY = float(os.environ.get("LABS_GOOGLE_RETRY_MAX_DELAY", 30.0))
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Rejections of one account's token; another account may still succeed
+ACCOUNT_STATUS = frozenset({401, 403})
+
+# Hedging sends a second copy of a slow request once the first has been
+# outstanding longer than the observed latency percentile. It costs quota,
+# so it is off unless enabled.
+HEDGE_REQUESTS = os.environ.get("LABS_GOOGLE_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("LABS_GOOGLE_HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_SAMPLES = int(os.environ.get("LABS_GOOGLE_HEDGE_MIN_SAMPLES", 20))
+
+T = TypeVar("T")
+
+
+def retry_after(response: Optional["requests.Response"]) -> Optional[float]:
+    """Seconds requested by a Retry-After header, as delta-seconds or an HTTP date"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Connection errors, timeouts and RETRYABLE_STATUS responses are retried;
+    any other HTTP error is fatal and raised immediately. Retry-After is
+    honoured when the server sends it. ACCOUNT_STATUS errors are left to the
+    caller, which can move the request to another account.
+    """
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY,
+                 retryable_status=RETRYABLE_STATUS):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable_status = retryable_status
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        import requests
+
+        if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        if isinstance(exc, requests.exceptions.HTTPError):
+            response = exc.response
+            return response is not None and response.status_code in self.retryable_status
+        return False
+
+    def is_account_error(self, exc: BaseException) -> bool:
+        """Whether exc rejects the account's credentials rather than the request"""
+        response = getattr(exc, "response", None)
+        return getattr(response, "status_code", None) in ACCOUNT_STATUS
+
+    def delay(self, attempt: int, exc: BaseException) -> float:
+        requested = retry_after(getattr(exc, "response", None))
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call_async(self, fn: Callable[[], Awaitable[T]], description: str = "request") -> T:
+        for attempt in range(self.max_attempts):
+            try:
+                return await fn()
+            except Exception as e:
+                if attempt + 1 >= self.max_attempts or not self.is_retryable(e):
+                    response = getattr(e, "response", None)
+                    if response is not None and getattr(response, "text", None):
+                        print(f"Response content: {response.text}")
+                    raise
+                delay = self.delay(attempt, e)
+                print(f"{description} failed ({str(e)}), retrying in {delay:.1f}s "
+                      f"[{attempt + 1}/{self.max_attempts - 1}]")
+                await asyncio.sleep(delay)
+
+
+class LatencyTracker:
+    """Rolling window of successful request latencies per endpoint"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, q: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def hedged_async(fn: Callable[[], Awaitable[T]], hedge_delay: Optional[float]) -> T:
+    """
+    Run fn, starting a second copy if the first hasn't finished after
+    hedge_delay seconds. The first successful result wins and the other
+    copy is cancelled; if both fail the last error is raised.
+    """
+    first = asyncio.ensure_future(fn())
+    if hedge_delay is None:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    pending = {first, asyncio.ensure_future(fn())}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+retry_policy = RetryPolicy()
+latency_tracker = LatencyTracker()
@@ -1,54 +1,230 @@
+import os
+import base64
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 from PIL import Image
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+DECODE_WORKERS = int(os.environ.get("LABS_GOOGLE_DECODE_WORKERS", min(8, os.cpu_count() or 1)))
+
+_decode_executor = None
+_decode_executor_lock = threading.Lock()
+
+def _pil_to_uint8(image: Image.Image) -> torch.Tensor:
+    """Return an RGB image as a [H, W, 3] uint8 tensor"""
+    # Convert PIL image to RGB if needed
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return torch.from_numpy(np.array(image))
 
 def pil2tensor(image: Union[Image.Image, List[Image.Image]]) -> torch.Tensor:
     """
     Convert PIL image(s) to tensor, matching ComfyUI's implementation.
-    
+
+    The float32 output is allocated once for the whole batch and filled in
+    place, instead of building a float copy per image and concatenating.
+
     Args:
         image: Single PIL Image or list of PIL Images
-        
+
     Returns:
         torch.Tensor: Image tensor with values normalized to [0, 1]
     """
     if isinstance(image, list):
         if len(image) == 0:
             return torch.empty(0)
-        return torch.cat([pil2tensor(img) for img in image], dim=0)
+        if len({img.size for img in image}) > 1:
+            # Mismatched sizes cannot share one buffer; let torch.cat report it
+            return torch.cat([pil2tensor(img) for img in image], dim=0)
+        images = image
+    else:
+        images = [image]
 
-    # Convert PIL image to RGB if needed
-    if image.mode == 'RGBA':
-        image = image.convert('RGB')
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
+    width, height = images[0].size
+    out = torch.empty((len(images), height, width, 3), dtype=torch.float32)
+    for i, img in enumerate(images):
+        out[i].copy_(_pil_to_uint8(img))
 
-    # Convert to numpy array and normalize to [0, 1]
-    img_array = np.array(image).astype(np.float32) / 255.0
-    
-    # Return tensor with shape [1, H, W, 3]
-    return torch.from_numpy(img_array)[None,]
+    # Normalize to [0, 1] in a single pass; returns shape [N, H, W, 3]
+    return out.div_(255.0)
+
+# Rows scaled per step in tensor2pil; keeps the float scratch cache-sized
+_CONVERT_ROWS = 64
 
 def tensor2pil(image: torch.Tensor) -> List[Image.Image]:
     """
     Convert tensor to PIL image(s), matching ComfyUI's implementation.
-    
+
+    Images are scaled and clamped a band of rows at a time in a small float
+    scratch buffer and truncated into one preallocated uint8 array, so no
+    batch-sized float temporary is created; each image is then built from a
+    view into that array.
+
     Args:
         image: Tensor with shape [B, H, W, 3] or [H, W, 3], values in range [0, 1]
-        
+
     Returns:
         List[Image.Image]: List of PIL Images
     """
-    batch_count = image.size(0) if len(image.shape) > 3 else 1
-    if batch_count > 1:
-        out = []
-        for i in range(batch_count):
-            out.extend(tensor2pil(image[i]))
-        return out
-
-    # Convert tensor to numpy array, scale to [0, 255], and clip values
-    numpy_image = np.clip(255.0 * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8)
-    
-    # Convert numpy array to PIL Image
-    return [Image.fromarray(numpy_image)]
\ No newline at end of file
+    if len(image.shape) <= 3:
+        image = image.unsqueeze(0)
+
+    source = image.detach().cpu()
+    if source.dtype not in (torch.float32, torch.float64):
+        source = source.float()
+    source = source.numpy()
+
+    # Scale to [0, 255], clip and truncate to uint8 like np.clip(...).astype(np.uint8)
+    numpy_images = np.empty(source.shape, dtype=np.uint8)
+    scratch = np.empty((_CONVERT_ROWS,) + source.shape[2:], dtype=source.dtype)
+    for src, dst in zip(source, numpy_images):
+        for top in range(0, src.shape[0], _CONVERT_ROWS):
+            band = scratch[:min(_CONVERT_ROWS, src.shape[0] - top)]
+            np.multiply(src[top:top + len(band)], 255.0, out=band)
+            np.clip(band, 0, 255, out=band)
+            dst[top:top + len(band)] = band
+
+    out = []
+    for numpy_image in numpy_images:
+        if numpy_image.ndim == 3 and numpy_image.shape[-1] == 1:
+            numpy_image = numpy_image[..., 0]
+        out.append(Image.fromarray(numpy_image))
+    return out
+
+def decode_image(encoded_image: Union[str, bytes], max_edge: int = 0) -> Tuple[bytes, Image.Image]:
+    """
+    Decode one generated image.
+
+    With max_edge set, the image is shrunk while decoding: JPEGs use the
+    decoder's DCT scaling (draft) and other formats reduce() before the
+    final resample, so the full-size bitmap is never materialized.
+
+    Args:
+        encoded_image: Base64 string or data URL from the API, or raw image bytes
+        max_edge: Longest edge in pixels of the decoded image, 0 keeps the original size
+
+    Returns:
+        Tuple[bytes, Image.Image]: The raw image bytes and the fully loaded RGB image
+    """
+    if isinstance(encoded_image, str):
+        if "," in encoded_image:
+            encoded_image = encoded_image.split(",", 1)[1]
+        image_bytes = base64.b64decode(encoded_image)
+    else:
+        image_bytes = encoded_image
+
+    return image_bytes, open_image(BytesIO(image_bytes), max_edge)
+
+def open_image(fp, max_edge: int = 0) -> Image.Image:
+    """
+    Fully load an encoded image from a file-like object as RGB.
+
+    Args:
+        fp: Binary file-like object (BytesIO, open file or mmap)
+        max_edge: Longest edge in pixels of the decoded image, 0 keeps the original size
+
+    Returns:
+        Image.Image: The loaded RGB image, independent of fp
+    """
+    image = Image.open(fp)
+    if max_edge and max(image.size) > max_edge:
+        # thumbnail() applies draft() and reduce() before resampling
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=2.0)
+    # Force the pixel decode here so it runs on the worker thread
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def _safe_decode_image(encoded_image: Union[str, bytes], max_edge: int = 0) -> Optional[Tuple[bytes, Image.Image]]:
+    try:
+        return decode_image(encoded_image, max_edge)
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        return None
+
+def _get_decode_executor() -> ThreadPoolExecutor:
+    global _decode_executor
+    if _decode_executor is None:
+        with _decode_executor_lock:
+            if _decode_executor is None:
+                _decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="labs-google-decode")
+    return _decode_executor
+
+def decode_images(encoded_images: List[Union[str, bytes]], max_edge: int = 0) -> List[Optional[Tuple[bytes, Image.Image]]]:
+    """
+    Decode several generated images in parallel, preserving order.
+
+    Base64 and PNG/JPEG decoding of each candidate runs on a shared thread
+    pool, so with several large candidates the CPU work overlaps instead of
+    adding up. Images that fail to decode are reported and returned as None.
+
+    Args:
+        encoded_images: Base64 strings, data URLs or raw image bytes
+        max_edge: Longest edge in pixels of each decoded image, 0 keeps the original size
+
+    Returns:
+        List of (image bytes, PIL Image) tuples, or None for failed entries
+    """
+    if len(encoded_images) <= 1:
+        return [_safe_decode_image(encoded_image, max_edge) for encoded_image in encoded_images]
+    return list(_get_decode_executor().map(_safe_decode_image, encoded_images, [max_edge] * len(encoded_images)))
+
+UPLOAD_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+def _encode_pixels(pixels: np.ndarray, image_format: str, quality: int) -> bytes:
+    if image_format == "JPEG" and simplejpeg is not None:
+        return simplejpeg.encode_jpeg(pixels, quality=quality, colorspace='RGB')
+    buffered = BytesIO()
+    Image.fromarray(pixels).save(buffered, format=image_format, quality=quality)
+    return buffered.getvalue()
+
+def encode_images(image: torch.Tensor, max_edge: int = 0, image_format: str = "JPEG",
+                  quality: int = 85) -> List[Tuple[str, bytes]]:
+    """
+    Encode every image of a batch for upload.
+
+    Downscaling and the uint8 conversion run once over the whole float
+    batch, so large references are never converted or compressed at full
+    size; the per-image compression then runs on the decode pool. JPEG uses
+    simplejpeg (libjpeg-turbo) when it is installed.
+
+    Args:
+        image: Tensor with shape [B, H, W, 3] or [H, W, 3], values in range [0, 1]
+        max_edge: Longest edge in pixels after downscaling, 0 keeps the original size
+        image_format: "JPEG" or "WEBP"
+        quality: Encoder quality, 1-100
+
+    Returns:
+        List[Tuple[str, bytes]]: MIME type and encoded bytes per image
+    """
+    image_format = image_format.upper()
+    if image_format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported upload format: {image_format}")
+
+    if len(image.shape) <= 3:
+        image = image.unsqueeze(0)
+
+    height, width = image.shape[1], image.shape[2]
+    if max_edge and max(height, width) > max_edge:
+        scale = max_edge / max(height, width)
+        size = (max(1, round(height * scale)), max(1, round(width * scale)))
+        image = torch.nn.functional.interpolate(
+            image.movedim(-1, 1), size=size, mode="bilinear", antialias=True, align_corners=False
+        ).movedim(1, -1)
+
+    pixels = list((image.detach() * 255.0).clamp_(0, 255).to(torch.uint8).cpu().contiguous().numpy())
+    if len(pixels) <= 1:
+        encoded = [_encode_pixels(frame, image_format, quality) for frame in pixels]
+    else:
+        encoded = list(_get_decode_executor().map(_encode_pixels, pixels, [image_format] * len(pixels),
+                                                   [quality] * len(pixels)))
+    return [(UPLOAD_FORMATS[image_format], image_bytes) for image_bytes in encoded]